@@ -1,28 +1,56 @@
+import uuid
 from datetime import datetime
 
 from yadisk import Client
-from gspread import Client as GClient
+from gspread import Client as GClient, Worksheet
+
+# Открытые листы таблиц Google по имени таблицы
+_worksheets: dict[str, Worksheet] = {}
 
 
 def upload_and_get_link(client: Client, filename: bytes, disk_folder: str) -> str:
     """
     Получает клиент Яндекс диска и имя файла, возвращает ссылку на файл.
+
+    Сессия клиента не закрывается, чтобы следующие загрузки не устанавливали
+    соединение заново. Короткий случайный суффикс исключает совпадение имен
+    при параллельной загрузке нескольких фото.
     """
-    save_filename = str(datetime.timestamp(datetime.now())).replace('.', '') + '.jpg'
-    with client:
-        client.upload(filename, f'/{disk_folder}/{save_filename}')
+    save_filename = (str(datetime.timestamp(datetime.now())).replace('.', '') +
+                     f'_{uuid.uuid4().hex[:4]}.jpg')
+    client.upload(filename, f'/{disk_folder}/{save_filename}')
 
     return save_filename
 
 
+def check_disk_folder(client: Client, disk_folder: str) -> None:
+    """
+    Проверяет доступность папки на Яндекс Диске.
+
+    Raises:
+        RuntimeError: Если папка не найдена.
+    """
+    if not client.is_dir(f'/{disk_folder}'):
+        raise RuntimeError(f"Папка {disk_folder} не найдена на Яндекс Диске")
+
+
+def get_worksheet(client: GClient, sheet_name: str) -> Worksheet:
+    """Возвращает первый лист таблицы, открывая таблицу только один раз."""
+    worksheet = _worksheets.get(sheet_name)
+    if worksheet is None:
+        # Открываем таблицу и первый лист
+        worksheet = client.open(sheet_name).sheet1
+        _worksheets[sheet_name] = worksheet
+    return worksheet
 
 
 def upload_information_to_gsheets(client: GClient, sheet_name: str, data: list) -> None:
-    # Открываем таблицу
-    spreadsheet = client.open(sheet_name)
-
-    # Открываем первый лист
-    worksheet = spreadsheet.sheet1
+    worksheet = get_worksheet(client, sheet_name)
 
     # Добавляем строку с данными
-    worksheet.append_row(data)
\ No newline at end of file
+    try:
+        worksheet.append_row(data)
+    except Exception:
+        # Таблицу могли переименовать или удалить, в следующий раз откроем заново
+        _worksheets.pop(sheet_name, None)
+        raise
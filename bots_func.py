@@ -6,6 +6,8 @@
 
 """
 
+import asyncio
+import logging
 from datetime import datetime, timedelta
 
 from aiogram import Bot
@@ -16,15 +18,35 @@ from dotenv import load_dotenv
 
 from api_functions import (upload_and_get_link,
                            upload_information_to_gsheets)
-from database_functions import get_user_by_id, save_driver_report
+from catalog import CatalogSnapshot
+from circuit_breaker import CircuitBreaker, CircuitOpenError, OPEN
+from stats import OK, ERROR, REJECTED
+from database_functions import (get_user_by_id, save_driver_report,
+                                save_pending_report, get_pending_reports,
+                                update_pending_report, get_driver_report,
+                                update_driver_report)
 from gps_functions import (get_address_from_coordinates,
-    parse_data_from_gps_dict)
+    parse_data_from_gps_dict, ADDRESS_KEYS)
+from tracing import Span
 from settings import (DEV_TG_ID, YANDEX_CLIENT, YA_DISK_FOLDER, GPS_API_KEY,
                       GOOGLE_CLIENT, GOOGLE_SHEET_NAME, database_path,
-                      TIMEDELTA)
+                      TIMEDELTA, GPS_BREAKER, YANDEX_BREAKER, GOOGLE_BREAKER,
+                      REPORT_STATS, PHOTO_UPLOAD_CONCURRENCY)
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Общий для всех заявок лимит одновременных загрузок на Яндекс Диск
+photo_upload_semaphore = asyncio.Semaphore(PHOTO_UPLOAD_CONCURRENCY)
+
+# Отметка для данных, которые будут дозагружены позже
+PENDING_MARK = 'ожидает дозагрузки'
+# Разделитель имен файлов в столбце photo_name и file_id в pending_reports
+PHOTO_SEPARATOR = ', '
+ADDRESS_COLUMNS = ['full_address', 'city', 'county', 'district', 'suburb',
+                   'street', 'house_number']
+
 
 async def download_photo(file_id: str, bot) -> bytes:
     """Получает file_id возвращает от телеграмма файл в bytes."""
@@ -55,11 +77,32 @@ def get_main_menu() -> InlineKeyboardMarkup:
     return keyboard
 
 
-def get_zone_keyboard(zones: list[str]):
+def cached_keyboard(build):
+    """
+    Кэширует клавиатуру справочника до смены версии справочников.
+
+    Кэш сбрасывается целиком, когда приходит снимок с новой версией.
+    """
+    cache = {}
+
+    def wrapper(catalog: CatalogSnapshot, *args):
+        if cache.get('version') != catalog.version:
+            cache.clear()
+            cache['version'] = catalog.version
+        if args not in cache:
+            cache[args] = build(catalog, *args)
+        return cache[args]
+
+    return wrapper
+
+
+@cached_keyboard
+def get_zone_keyboard(catalog: CatalogSnapshot):
     keyboard = InlineKeyboardMarkup()
-    for zone in zones:
+    for zone in catalog.zones:
         keyboard.add(
-            InlineKeyboardButton(text=zone, callback_data=f"zone:{zone}"))
+            InlineKeyboardButton(text=zone.title,
+                                 callback_data=f"zone:{zone.id}"))
     return keyboard
 
 
@@ -72,7 +115,9 @@ def get_location_keyboard():
     return keyboard
 
 
-def get_reason_keyboard(reasons: list[str], page=0):
+@cached_keyboard
+def get_reason_keyboard(catalog: CatalogSnapshot, page=0):
+    reasons = catalog.reasons
     reasons_per_page = 7
     start = page * reasons_per_page
     end = start + reasons_per_page
@@ -80,10 +125,9 @@ def get_reason_keyboard(reasons: list[str], page=0):
 
     keyboard = InlineKeyboardMarkup(row_width=1)
     for reason in reasons_page:
-        reason.find('.')
         keyboard.add(
-            InlineKeyboardButton(reason,
-                                 callback_data=f"reason:{reason[:reason.find('.') + 1]}"))
+            InlineKeyboardButton(reason.title,
+                                 callback_data=f"reason:{reason.id}"))
 
     # Добавляем кнопки "⬅ Назад" и "➡ Далее"
     navigation_buttons = []
@@ -100,11 +144,12 @@ def get_reason_keyboard(reasons: list[str], page=0):
     return keyboard
 
 
-def get_reason_full_text(reasons: list, part: str) -> str | None:
-    for reason in reasons:
-        if reason.startswith(part):
-            return reason
-    return None
+def parse_callback_id(callback_data: str) -> int | None:
+    """Возвращает id записи справочника из callback_data вида "zone:3"."""
+    try:
+        return int(callback_data.split(":")[1])
+    except (IndexError, ValueError):
+        return None
 
 
 def get_confirmation_keyboard():
@@ -116,52 +161,269 @@ def get_confirmation_keyboard():
     return keyboard
 
 
-async def save_user_data(data: dict, tg_bot: Bot):
-    gs_data = []
-    address_dict = []
+async def call_with_breaker(breaker: CircuitBreaker, func, *args):
+    """Выполняет блокирующий вызов в отдельном потоке через предохранитель.
+
+    Результат вызова учитывается в статистике REPORT_STATS.
+    """
     try:
-        gs_data = list(
-            get_user_by_id(data.get('user_id'), database_path).values())
-    except Exception as e:
-        await tg_bot.send_message(DEV_TG_ID,
-                                  f"Произошла ошибка {e} при поиске пользователя {data}.")
-        return
-    print(data)
+        result = await asyncio.to_thread(breaker.call, func, *args)
+    except CircuitOpenError:
+        REPORT_STATS.call_finished(breaker.name, REJECTED)
+        raise
+    except Exception:
+        REPORT_STATS.call_finished(breaker.name, ERROR)
+        raise
+    REPORT_STATS.call_finished(breaker.name, OK)
+    return result
+
+
+async def upload_report_photo(file_id: str, tg_bot: Bot,
+                              trace_id: str | None = None,
+                              notify_dev: bool = True) -> str | None:
+    """
+    Загружает фото заявки на Яндекс Диск.
+
+    Ошибка загрузки сообщается в DEV_TG_ID, если notify_dev, иначе только
+    записывается в лог: при повторных попытках о ней уже сообщали.
+
+    Returns:
+        str | None: Имя файла на диске или None, если диск недоступен.
+    """
+    if YANDEX_BREAKER.state == OPEN:
+        return None
     try:
-        downloaded_file = await download_photo(data.get('photo'), tg_bot)
-        ya_disk_file_name = upload_and_get_link(YANDEX_CLIENT, downloaded_file,
-                                                YA_DISK_FOLDER)
-        data.update({'ya_disk_file_name': ya_disk_file_name})
+        async with photo_upload_semaphore:
+            with Span(trace_id, 'download_photo'):
+                downloaded_file = await download_photo(file_id, tg_bot)
+            with Span(trace_id, 'disk_upload'):
+                return await call_with_breaker(YANDEX_BREAKER,
+                                               upload_and_get_link,
+                                               YANDEX_CLIENT, downloaded_file,
+                                               YA_DISK_FOLDER)
+    except CircuitOpenError:
+        return None
     except Exception as e:
-        await tg_bot.send_message(DEV_TG_ID,
-                                  f"Произошла ошибка {e} при загрузке фото {data}.")
-        return
+        if notify_dev:
+            await tg_bot.send_message(DEV_TG_ID,
+                                      f"Произошла ошибка {e} при загрузке фото {file_id}.")
+        else:
+            logger.warning("Фото %s не загружено: %s", file_id, e)
+        return None
+
+
+async def upload_report_photos(file_ids: list[str], tg_bot: Bot,
+                               trace_id: str | None = None,
+                               names: list[str] | None = None,
+                               notify_dev: bool = True
+                               ) -> list[str | None]:
+    """
+    Параллельно загружает фото заявки на Яндекс Диск.
+
+    Args:
+        file_ids (list[str]): file_id фото в Telegram.
+        names (list[str] | None): Уже известные имена файлов на диске,
+            загружаются только фото с именем PENDING_MARK.
+        notify_dev (bool): Сообщать об ошибках в DEV_TG_ID.
+
+    Returns:
+        list[str | None]: Имена файлов в порядке file_ids, None для фото,
+        которые загрузить не удалось.
+    """
+    names = names or [PENDING_MARK] * len(file_ids)
+
+    async def upload(file_id: str, name: str) -> str | None:
+        if name != PENDING_MARK:
+            return name
+        return await upload_report_photo(file_id, tg_bot, trace_id,
+                                         notify_dev)
+
+    return list(await asyncio.gather(*(upload(file_id, name) for
+                                       file_id, name in zip(file_ids, names))))
+
+
+async def get_report_address(latitude: float, longitude: float,
+                             tg_bot: Bot,
+                             trace_id: str | None = None,
+                             notify_dev: bool = True) -> dict | None:
+    """
+    Получает адрес по координатам.
+
+    Ошибка сообщается в DEV_TG_ID, если notify_dev, иначе только
+    записывается в лог, как в upload_report_photo.
+
+    Returns:
+        dict | None: Разобранный адрес или None, если сервис недоступен.
+    """
     try:
-        address = get_address_from_coordinates(data.get('latitude'),
-                                               data.get('longitude'),
-                                               GPS_API_KEY)
-        address_dict = parse_data_from_gps_dict(address)
+        with Span(trace_id, 'geocode'):
+            address = await call_with_breaker(GPS_BREAKER,
+                                              get_address_from_coordinates,
+                                              latitude, longitude,
+                                              GPS_API_KEY)
+        return parse_data_from_gps_dict(address)
+    except CircuitOpenError:
+        return None
     except Exception as e:
-        await tg_bot.send_message(DEV_TG_ID,
-                                  f"Произошла ошибка {e} при получении адреса {data}.")
-        return
+        if notify_dev:
+            await tg_bot.send_message(DEV_TG_ID,
+                                      f"Произошла ошибка {e} при получении адреса "
+                                      f"{latitude}, {longitude}.")
+        else:
+            logger.warning("Адрес %s, %s не получен: %s", latitude, longitude,
+                           e)
+        return None
+
+
+def build_report_row(created_at: str, user: dict, data: dict, photo_name: str,
+                     address_dict: dict) -> list:
+    """Собирает строку заявки в порядке столбцов таблицы Google."""
+    return [created_at,
+            user.get('full_name'), user.get('phone_number'),
+            user.get('username'), data.get('user_id'), data.get('zone'),
+            data.get('latitude'), data.get('longitude'), data.get('reason'),
+            data.get('gos_number'), photo_name, *address_dict.values()]
+
+
+async def save_user_data(data: dict, tg_bot: Bot):
+    """
+    Сохраняет заявку водителя.
+
+    Если Яндекс Диск или сервис адресов недоступны, заявка сохраняется в БД
+    с отметкой PENDING_MARK вместо недостающих данных, а строка в таблицу
+    Google отправляется после их дозагрузки (complete_pending_reports).
+    """
+    REPORT_STATS.in_progress += 1
     try:
-        del data['photo']
-        gs_data.extend(list(data.values()))
-        if address_dict:
-            gs_data.extend(list(address_dict.values()))
-        gs_data.insert(0, (datetime.now() + timedelta(hours=TIMEDELTA)).strftime(
-        "%Y-%m-%d %H:%M:%S"))
-        print(gs_data)
-        upload_information_to_gsheets(GOOGLE_CLIENT, GOOGLE_SHEET_NAME,
-                                      gs_data)
+        await save_report(data, tg_bot)
+    finally:
+        REPORT_STATS.in_progress -= 1
+
+
+async def save_report(data: dict, tg_bot: Bot):
+    """Выполняет сохранение заявки, см. save_user_data."""
+    try:
+        user = get_user_by_id(data.get('user_id'), database_path)
     except Exception as e:
         await tg_bot.send_message(DEV_TG_ID,
-                                  f"Произошла ошибка {e} при загрузке ифнормации {gs_data}.")
+                                  f"Произошла ошибка {e} при поиске пользователя {data}.")
         return
+    created_at = (datetime.now() + timedelta(hours=TIMEDELTA)).strftime(
+        "%Y-%m-%d %H:%M:%S")
+    missing = []
+    trace_id = data.get('trace_id')
+
+    photos = data.get('photos', [])
+
+    # Фото и адрес не зависят друг от друга, получаем их одновременно
+    photo_names, address_dict = await asyncio.gather(
+        upload_report_photos(photos, tg_bot, trace_id),
+        get_report_address(data.get('latitude'), data.get('longitude'),
+                           tg_bot, trace_id))
+    if None in photo_names:
+        missing.append('photo')
+    photo_name = PHOTO_SEPARATOR.join(name or PENDING_MARK
+                                      for name in photo_names)
+
+    if address_dict is None:
+        missing.append('address')
+        address_dict = dict.fromkeys(ADDRESS_KEYS, PENDING_MARK)
+
+    gs_data = build_report_row(created_at, user, data, photo_name,
+                               address_dict)
+    if missing:
+        # Неполную строку в таблицу не отправляем, дозагрузим целиком
+        missing.append('gsheets')
+    else:
+        try:
+            with Span(trace_id, 'sheet_append'):
+                await call_with_breaker(GOOGLE_BREAKER,
+                                        upload_information_to_gsheets,
+                                        GOOGLE_CLIENT, GOOGLE_SHEET_NAME,
+                                        gs_data)
+        except CircuitOpenError:
+            missing.append('gsheets')
+        except Exception as e:
+            missing.append('gsheets')
+            await tg_bot.send_message(DEV_TG_ID,
+                                      f"Произошла ошибка {e} при загрузке ифнормации {gs_data}.")
+
     try:
-        save_driver_report(database_path, gs_data)
+        with Span(trace_id, 'sqlite_insert'):
+            report_id = save_driver_report(database_path, list(gs_data),
+                                           ','.join(photos),
+                                           data.get('zone_id'))
+        if report_id is None:
+            raise RuntimeError("заявка не сохранена")
+        REPORT_STATS.report_saved(data.get('zone'), data.get('reason'))
+        if missing:
+            logger.warning("Заявка %s сохранена без: %s", report_id,
+                           ', '.join(missing))
+            save_pending_report(database_path, report_id, created_at,
+                                ','.join(photos), missing)
+            REPORT_STATS.pending += 1
     except Exception as e:
         await tg_bot.send_message(DEV_TG_ID,
                                   f"Произошла ошибка {e} при сохраненнии в БД ифнормации {gs_data}.")
-        return
\ No newline at end of file
+
+
+async def complete_pending_reports(tg_bot: Bot) -> None:
+    """Дозагружает данные заявок, сохраненных без фото, адреса или строки
+    в таблице Google."""
+    for pending in get_pending_reports(database_path):
+        report_id = pending['report_id']
+        row = get_driver_report(database_path, report_id)
+        if row is None:
+            update_pending_report(database_path, pending['id'], [])
+            REPORT_STATS.pending -= 1
+            continue
+        missing = pending['missing']
+
+        if 'photo' in missing:
+            photos = pending['photo'].split(',')
+            # Об ошибках этих фото уже сообщили при сохранении заявки
+            photo_names = await upload_report_photos(
+                photos, tg_bot, names=row[9].split(PHOTO_SEPARATOR),
+                notify_dev=False)
+            update_driver_report(
+                database_path, report_id,
+                {'photo_name': PHOTO_SEPARATOR.join(
+                    name or PENDING_MARK for name in photo_names)})
+            if None not in photo_names:
+                missing.remove('photo')
+
+        if 'address' in missing:
+            address_dict = await get_report_address(row[5], row[6], tg_bot,
+                                                    notify_dev=False)
+            if address_dict is not None:
+                update_driver_report(database_path, report_id,
+                                     dict(zip(ADDRESS_COLUMNS,
+                                              address_dict.values())))
+                missing.remove('address')
+
+        if missing == ['gsheets']:
+            gs_data = [pending['created_at'],
+                       *get_driver_report(database_path, report_id)]
+            try:
+                await call_with_breaker(GOOGLE_BREAKER,
+                                        upload_information_to_gsheets,
+                                        GOOGLE_CLIENT, GOOGLE_SHEET_NAME,
+                                        gs_data)
+                missing.remove('gsheets')
+            except Exception as e:
+                logger.warning("Заявка %s не загружена в таблицу: %s",
+                               report_id, e)
+
+        update_pending_report(database_path, pending['id'], missing)
+        if not missing:
+            REPORT_STATS.pending -= 1
+
+
+async def pending_reports_loop(tg_bot: Bot, interval: int) -> None:
+    """Периодически дозагружает отложенные заявки."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await complete_pending_reports(tg_bot)
+        except Exception as e:
+            logger.error("Ошибка при дозагрузке заявок: %s", e)
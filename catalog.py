@@ -0,0 +1,119 @@
+"""
+Справочники техзон и причин невывоза.
+
+Справочники хранятся в базе данных и загружаются в неизменяемый снимок
+в памяти. Обработчики читают только снимок, а после правки справочника
+администратором снимок пересобирается и подменяется целиком, поэтому
+обработчик никогда не видит наполовину обновленные данные.
+"""
+import logging
+from typing import NamedTuple
+
+from database_functions import (get_catalog_version, get_catalog_items,
+                                seed_catalog, add_catalog_item,
+                                update_catalog_item, get_zone_bounds,
+                                set_zone_bounds, link_reports_to_zones)
+from geo_index import BoundingBox, ZoneIndex
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogItem(NamedTuple):
+    """Запись справочника."""
+    id: int
+    title: str
+
+
+class CatalogSnapshot:
+    """Неизменяемый снимок справочников с индексами по id.
+
+    zone_index содержит границы активных техзон, для которых они заданы.
+    """
+
+    def __init__(self, version: int, zones: list[tuple[int, str]],
+                 reasons: list[tuple[int, str]],
+                 zone_bounds: list[tuple] = ()):
+        self.version = version
+        self.zones = tuple(CatalogItem(*item) for item in zones)
+        self.reasons = tuple(CatalogItem(*item) for item in reasons)
+        self._zones_by_id = {item.id: item for item in self.zones}
+        self._reasons_by_id = {item.id: item for item in self.reasons}
+        self._zones_by_title = {item.title: item for item in self.zones}
+        self.zone_index = ZoneIndex({
+            zone_id: BoundingBox(*bounds)
+            for zone_id, *bounds in zone_bounds
+            if zone_id in self._zones_by_id})
+
+    def get_zone(self, zone_id: int) -> CatalogItem | None:
+        """Возвращает техзону по id или None, если она отключена."""
+        return self._zones_by_id.get(zone_id)
+
+    def get_zone_by_title(self, title: str) -> CatalogItem | None:
+        """Возвращает активную техзону по названию."""
+        return self._zones_by_title.get(title)
+
+    def get_reason(self, reason_id: int) -> CatalogItem | None:
+        """Возвращает причину по id или None, если она отключена."""
+        return self._reasons_by_id.get(reason_id)
+
+
+_snapshot = CatalogSnapshot(0, [], [])
+
+
+def get_catalog() -> CatalogSnapshot:
+    """Возвращает текущий снимок справочников."""
+    return _snapshot
+
+
+def reload_catalog(db_path: str) -> CatalogSnapshot:
+    """Перечитывает справочники из базы и подменяет снимок."""
+    global _snapshot
+    _snapshot = CatalogSnapshot(get_catalog_version(db_path),
+                                get_catalog_items(db_path, 'zones'),
+                                get_catalog_items(db_path, 'reasons'),
+                                get_zone_bounds(db_path))
+    return _snapshot
+
+
+def load_catalog(db_path: str, default_zones: list[str],
+                 default_reasons: list[str]) -> CatalogSnapshot:
+    """
+    Загружает справочники, заполняя пустые таблицы значениями по умолчанию.
+
+    Заявки без zone_id связываются с техзонами заполненного справочника.
+    """
+    seed_catalog(db_path, 'zones', default_zones)
+    seed_catalog(db_path, 'reasons', default_reasons)
+    unlinked = link_reports_to_zones(db_path)
+    if unlinked:
+        logger.warning("Заявок с техзоной не из справочника: %s", unlinked)
+    return reload_catalog(db_path)
+
+
+def add_item(db_path: str, table: str, title: str) -> int:
+    """Добавляет запись в справочник и обновляет снимок."""
+    item_id = add_catalog_item(db_path, table, title)
+    reload_catalog(db_path)
+    return item_id
+
+
+def rename_item(db_path: str, table: str, item_id: int, title: str) -> bool:
+    """Переименовывает запись справочника и обновляет снимок."""
+    result = update_catalog_item(db_path, table, item_id, title=title)
+    reload_catalog(db_path)
+    return result
+
+
+def remove_item(db_path: str, table: str, item_id: int) -> bool:
+    """Отключает запись справочника и обновляет снимок."""
+    result = update_catalog_item(db_path, table, item_id, active=False)
+    reload_catalog(db_path)
+    return result
+
+
+def set_bounds(db_path: str, zone_id: int,
+               bounds: BoundingBox | None) -> bool:
+    """Задает или сбрасывает границы техзоны и обновляет снимок."""
+    result = set_zone_bounds(db_path, zone_id, bounds)
+    reload_catalog(db_path)
+    return result
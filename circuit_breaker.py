@@ -0,0 +1,122 @@
+"""
+Предохранители (circuit breaker) для обращений к внешним сервисам.
+
+Предохранитель следит за долей неудачных вызовов в скользящем окне.
+Когда доля превышает порог, цепь размыкается, и вызовы сразу завершаются
+исключением CircuitOpenError, не дожидаясь таймаута сервиса. По истечении
+времени восстановления пропускается один пробный вызов (полуоткрытое
+состояние): успех замыкает цепь, неудача снова размыкает её.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Цепь разомкнута, вызов внешнего сервиса не выполнялся."""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для одного внешнего сервиса.
+
+    Args:
+        name (str): Имя сервиса для логов.
+        failure_rate (float): Доля неудач в окне, при которой цепь размыкается.
+        window_size (int): Количество последних вызовов в окне.
+        min_calls (int): Минимум вызовов в окне для принятия решения.
+        recovery_timeout (float): Секунды до пробного вызова после размыкания.
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5,
+                 window_size: int = 10, min_calls: int = 3,
+                 recovery_timeout: float = 60.0):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.recovery_timeout = recovery_timeout
+        self._results = deque(maxlen=window_size)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """Текущее состояние цепи с учетом истекшего времени восстановления."""
+        with self._lock:
+            if (self._state == OPEN and
+                    time.monotonic() - self._opened_at >= self.recovery_timeout):
+                return HALF_OPEN
+            return self._state
+
+    def allow_request(self) -> bool:
+        """Проверяет, можно ли сейчас обращаться к сервису."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    return False
+                self._state = HALF_OPEN
+                self._probe_in_flight = False
+            # В полуоткрытом состоянии пропускаем только один пробный вызов
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        """Учитывает успешный вызов."""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                logger.info("Сервис %s восстановлен, цепь замкнута", self.name)
+                self._state = CLOSED
+                self._probe_in_flight = False
+                self._results.clear()
+            self._results.append(True)
+
+    def record_failure(self) -> None:
+        """Учитывает неудачный вызов и при необходимости размыкает цепь."""
+        with self._lock:
+            self._results.append(False)
+            if self._state == HALF_OPEN:
+                self._open()
+                return
+            failures = self._results.count(False)
+            if (len(self._results) >= self.min_calls and
+                    failures / len(self._results) >= self.failure_rate):
+                self._open()
+
+    def _open(self) -> None:
+        """Размыкает цепь. Вызывается под блокировкой."""
+        if self._state != OPEN:
+            logger.warning("Сервис %s недоступен, цепь разомкнута", self.name)
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Вызывает функцию через предохранитель.
+
+        Raises:
+            CircuitOpenError: Если цепь разомкнута.
+        """
+        if not self.allow_request():
+            raise CircuitOpenError(f"Сервис {self.name} временно недоступен")
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
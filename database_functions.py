@@ -5,10 +5,20 @@ import os
 import sqlite3
 import time
 
+from migrations import apply_migrations
+
+# Таблицы справочников, редактируемых администраторами
+CATALOG_TABLES = ('zones', 'reasons')
+
+# Кэш id зарегистрированных и заблокированных пользователей.
+# Пока кэш не загружен (None), проверки обращаются к базе данных.
+_users_cache: set[int] | None = None
+_banned_cache: set[int] | None = None
+
 
 def init_db(database_folder: str, database_name: str) -> str:
     """
-    Инициализирует базу данных.
+    Инициализирует базу данных и применяет новые миграции схемы.
 
     Args:
         database_folder (str): Путь к папке, где будет размещена база данных.
@@ -24,64 +34,8 @@ def init_db(database_folder: str, database_name: str) -> str:
         # Формируем полный путь к базе данных
         db_path = os.path.join(database_folder, database_name)
 
-        # Подключаемся к базе и создаём таблицы
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Создание таблицы пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY,
-                full_name TEXT,
-                phone_number TEXT,
-                username TEXT
-            )
-        ''')
-
-        # Создание таблицы администраторов
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS admins (
-                id INTEGER PRIMARY KEY,
-                user_id INTEGER
-            )
-        ''')
-
-        # Создание таблицы отчетов КГМ
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS driver_reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp INTEGER,
-                full_name TEXT,
-                phone_number TEXT,
-                username TEXT,
-                user_id INTEGER,
-                zone TEXT,
-                latitude REAL,
-                longitude REAL,
-                reason TEXT,
-                gos_number TEXT,
-                photo_name TEXT,
-                full_address TEXT,
-                city TEXT,
-                county TEXT,
-                district TEXT,
-                suburb TEXT,
-                street TEXT,
-                house_number TEXT
-            )
-        ''')
-
-        # Создание таблицы заблокированных пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ban_list (
-                id INTEGER PRIMARY KEY,
-                user_id INTEGER
-            )
-        ''')
-
-        # Сохраняем изменения и закрываем соединение
-        conn.commit()
-        conn.close()
+        # Создаём или обновляем таблицы
+        apply_migrations(db_path)
         return db_path
 
     except Exception as e:
@@ -89,10 +43,33 @@ def init_db(database_folder: str, database_name: str) -> str:
         raise
 
 
+def load_user_caches(db_path: str) -> tuple[int, int]:
+    """
+    Загружает в память id зарегистрированных и заблокированных пользователей.
+
+    Заодно читает таблицу заявок, чтобы ее страницы попали в кэш ОС.
+
+    Returns:
+        tuple[int, int]: Количество пользователей и заблокированных.
+    """
+    global _users_cache, _banned_cache
+    conn = sqlite3.connect(db_path)
+    try:
+        users = {row[0] for row in conn.execute("SELECT id FROM users")}
+        banned = {row[0] for row in conn.execute("SELECT user_id FROM ban_list")}
+        conn.execute("SELECT COUNT(*), MAX(id) FROM driver_reports").fetchone()
+    finally:
+        conn.close()
+    _users_cache, _banned_cache = users, banned
+    return len(users), len(banned)
+
+
 def is_user_registered(db_path: str, user_id: int):
     """
     Проверка пользователя на наличие в базе данных.
     """
+    if _users_cache is not None:
+        return user_id in _users_cache
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     cursor.execute("SELECT id FROM users WHERE id = ?", (user_id,))
@@ -117,6 +94,8 @@ def is_user_banned(db_path: str, user_id: int):
     """
     Проверка пользователя на наличие в базе данных.
     """
+    if _banned_cache is not None:
+        return user_id in _banned_cache
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     cursor.execute("SELECT id FROM ban_list WHERE user_id = ?", (user_id,))
@@ -137,19 +116,26 @@ def register_user(db_path: str, user_id: int, full_name: str,
         (user_id, full_name, phone_number, username))
     conn.commit()
     conn.close()
+    if _users_cache is not None:
+        _users_cache.add(user_id)
 
 
-def save_driver_report(db_path: str, report_data: list) -> bool:
+def save_driver_report(db_path: str, report_data: list,
+                       photo_ids: str | None = None,
+                       zone_id: int | None = None) -> int | None:
     """
     Сохраняет информацию о заявке в базу данных.
 
     Args:
         db_path (str): Путь к базе данных SQLite.
         report_data (list): Список данных.
+        photo_ids (str | None): file_id фото заявки в Telegram через запятую.
+        zone_id (int | None): id техзоны в справочнике.
 
     Returns:
-        bool: True, если данные успешно сохранены, иначе False.
+        int | None: id сохраненной заявки или None, если сохранить не удалось.
     """
+    conn = None
     try:
         conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
@@ -160,16 +146,18 @@ def save_driver_report(db_path: str, report_data: list) -> bool:
             INSERT INTO driver_reports (
                 timestamp, full_name, phone_number, username, user_id, zone, latitude, 
                 longitude, reason, gos_number, photo_name, full_address, city, 
-                county, district, suburb, street, house_number
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', report_data[1:])
+                county, district, suburb, street, house_number, photo_ids,
+                zone_id
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+                ?)
+        ''', (*report_data[1:], photo_ids, zone_id))
 
         conn.commit()
-        return True
+        return cursor.lastrowid
 
     except sqlite3.Error as e:
         print(f"Ошибка при сохранении данных: {e}")
-        return False
+        return None
 
     finally:
         if conn:
@@ -236,6 +224,10 @@ def ban_user(db_path: str, user_id: int) -> bool:
         cursor.execute("INSERT INTO ban_list (user_id) VALUES (?)", (user_id,))
 
         conn.commit()
+        if _users_cache is not None:
+            _users_cache.discard(user_id)
+        if _banned_cache is not None:
+            _banned_cache.add(user_id)
         return True
 
     except sqlite3.Error as e:
@@ -245,3 +237,432 @@ def ban_user(db_path: str, user_id: int) -> bool:
     finally:
         if conn:
             conn.close()
+
+
+def save_pending_report(db_path: str, report_id: int, created_at: str,
+                        photo: str, missing: list[str]) -> None:
+    """
+    Запоминает заявку, сохраненную без части данных, для последующей дозагрузки.
+
+    Args:
+        db_path (str): Путь к базе данных SQLite.
+        report_id (int): id заявки в таблице driver_reports.
+        created_at (str): Время заявки в формате, используемом в таблице Google.
+        photo (str): file_id фото в Telegram.
+        missing (list[str]): Недостающие части: photo, address, gsheets.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(
+            "INSERT INTO pending_reports (report_id, created_at, photo, missing) "
+            "VALUES (?, ?, ?, ?)",
+            (report_id, created_at, photo, ','.join(missing)))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_pending_reports(db_path: str) -> list[dict]:
+    """
+    Возвращает заявки, ожидающие дозагрузки данных.
+
+    Returns:
+        list[dict]: Список заявок с ключами id, report_id, created_at, photo,
+        missing.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT id, report_id, created_at, photo, missing "
+            "FROM pending_reports ORDER BY id").fetchall()
+    finally:
+        conn.close()
+    return [{"id": row[0], "report_id": row[1], "created_at": row[2],
+             "photo": row[3], "missing": row[4].split(',') if row[4] else []}
+            for row in rows]
+
+
+def update_pending_report(db_path: str, pending_id: int,
+                          missing: list[str]) -> None:
+    """
+    Обновляет список недостающих частей заявки, удаляет запись если их нет.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        if missing:
+            conn.execute("UPDATE pending_reports SET missing = ? WHERE id = ?",
+                         (','.join(missing), pending_id))
+        else:
+            conn.execute("DELETE FROM pending_reports WHERE id = ?",
+                         (pending_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_driver_report(db_path: str, report_id: int) -> list | None:
+    """
+    Возвращает заявку из driver_reports в порядке столбцов таблицы Google.
+
+    Returns:
+        list | None: Значения от full_name до house_number или None.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute('''
+            SELECT full_name, phone_number, username, user_id, zone, latitude,
+                longitude, reason, gos_number, photo_name, full_address, city,
+                county, district, suburb, street, house_number
+            FROM driver_reports WHERE id = ?
+        ''', (report_id,)).fetchone()
+    finally:
+        conn.close()
+    return list(row) if row else None
+
+
+def update_driver_report(db_path: str, report_id: int, fields: dict) -> None:
+    """
+    Обновляет поля заявки в driver_reports.
+
+    Args:
+        db_path (str): Путь к базе данных SQLite.
+        report_id (int): id заявки.
+        fields (dict): Столбец -> новое значение.
+    """
+    columns = ', '.join(f"{column} = ?" for column in fields)
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(f"UPDATE driver_reports SET {columns} WHERE id = ?",
+                     (*fields.values(), report_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_catalog_version(db_path: str) -> int:
+    """Возвращает текущую версию справочников."""
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute(
+            "SELECT version FROM catalog_version WHERE id = 1").fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else 0
+
+
+def get_catalog_items(db_path: str, table: str) -> list[tuple[int, str]]:
+    """
+    Возвращает активные записи справочника.
+
+    Args:
+        db_path (str): Путь к базе данных SQLite.
+        table (str): Имя справочника из CATALOG_TABLES.
+
+    Returns:
+        list[tuple[int, str]]: Пары (id, название) в порядке отображения.
+    """
+    if table not in CATALOG_TABLES:
+        raise ValueError(f"Неизвестный справочник {table}")
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            f"SELECT id, title FROM {table} WHERE active = 1 "
+            f"ORDER BY position, id").fetchall()
+    finally:
+        conn.close()
+
+
+def seed_catalog(db_path: str, table: str, titles: list[str]) -> None:
+    """
+    Заполняет пустой справочник начальными значениями.
+    """
+    if table not in CATALOG_TABLES:
+        raise ValueError(f"Неизвестный справочник {table}")
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                return
+            conn.executemany(
+                f"INSERT INTO {table} (title, position) VALUES (?, ?)",
+                [(title, position) for position, title in enumerate(titles)])
+            conn.execute(
+                "UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+    finally:
+        conn.close()
+
+
+def link_reports_to_zones(db_path: str) -> int:
+    """
+    Заполняет zone_id заявок без него по названию техзоны.
+
+    Заявки, сохраненные до появления zone_id, связываются с техзоной
+    справочника, в том числе отключенной. Повторный вызов обрабатывает
+    только заявки, которые еще не связаны.
+
+    Returns:
+        int: Количество заявок, для которых техзона не найдена.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.execute(
+                "UPDATE driver_reports SET zone_id = (SELECT MIN(id) "
+                "FROM zones WHERE zones.title = driver_reports.zone) "
+                "WHERE zone_id IS NULL")
+        return conn.execute("SELECT COUNT(*) FROM driver_reports "
+                            "WHERE zone_id IS NULL").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def add_catalog_item(db_path: str, table: str, title: str) -> int:
+    """
+    Добавляет запись в конец справочника и увеличивает версию справочников.
+
+    Returns:
+        int: id новой записи.
+    """
+    if table not in CATALOG_TABLES:
+        raise ValueError(f"Неизвестный справочник {table}")
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            cursor = conn.execute(
+                f"INSERT INTO {table} (title, position) "
+                f"SELECT ?, COALESCE(MAX(position), -1) + 1 FROM {table}",
+                (title,))
+            conn.execute(
+                "UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+            return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+def update_catalog_item(db_path: str, table: str, item_id: int,
+                        title: str | None = None,
+                        active: bool | None = None) -> bool:
+    """
+    Переименовывает или отключает запись справочника.
+
+    id записи не меняется, поэтому кнопки в уже отправленных сообщениях
+    продолжают указывать на ту же запись.
+
+    Returns:
+        bool: True, если запись найдена и изменена.
+    """
+    if table not in CATALOG_TABLES:
+        raise ValueError(f"Неизвестный справочник {table}")
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            cursor = conn.execute(
+                f"UPDATE {table} SET title = COALESCE(?, title), "
+                f"active = COALESCE(?, active) WHERE id = ?",
+                (title, None if active is None else int(active), item_id))
+            if cursor.rowcount == 0:
+                return False
+            conn.execute(
+                "UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+            return True
+    finally:
+        conn.close()
+
+
+def get_reports_since(db_path: str, timestamp: int) -> list[tuple[str, str]]:
+    """
+    Возвращает техзону и причину заявок, сохраненных начиная с timestamp.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT zone, reason FROM driver_reports WHERE timestamp >= ?",
+            (timestamp,)).fetchall()
+    finally:
+        conn.close()
+
+
+def count_pending_reports(db_path: str) -> int:
+    """Возвращает количество заявок, ожидающих дозагрузки данных."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT COUNT(*) FROM pending_reports").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def save_stats_snapshot(db_path: str, day: str, data: str) -> None:
+    """Сохраняет снимок счетчиков статистики за день."""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO stats_snapshot (day, data) VALUES (?, ?)",
+            (day, data))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_stats_snapshot(db_path: str, day: str) -> str | None:
+    """Возвращает снимок счетчиков статистики за день или None."""
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute("SELECT data FROM stats_snapshot WHERE day = ?",
+                           (day,)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+def get_zone_bounds(db_path: str) -> list[tuple]:
+    """
+    Возвращает границы техзон, для которых они заданы.
+
+    Returns:
+        list[tuple]: Кортежи (id, min_lat, min_lon, max_lat, max_lon).
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT id, min_lat, min_lon, max_lat, max_lon FROM zones "
+            "WHERE min_lat IS NOT NULL").fetchall()
+    finally:
+        conn.close()
+
+
+def set_zone_bounds(db_path: str, zone_id: int,
+                    bounds: tuple | None) -> bool:
+    """
+    Задает границы техзоны (min_lat, min_lon, max_lat, max_lon) или
+    сбрасывает их, если bounds равно None.
+
+    Returns:
+        bool: True, если техзона найдена.
+    """
+    values = tuple(bounds) if bounds else (None, None, None, None)
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            cursor = conn.execute(
+                "UPDATE zones SET min_lat = ?, min_lon = ?, max_lat = ?, "
+                "max_lon = ? WHERE id = ?", (*values, zone_id))
+            if cursor.rowcount == 0:
+                return False
+            conn.execute(
+                "UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+            return True
+    finally:
+        conn.close()
+
+
+def get_supervisors(db_path: str) -> list[tuple[int, int]]:
+    """Возвращает пары (user_id, zone_id) кураторов техзон."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT user_id, zone_id FROM supervisors "
+            "ORDER BY user_id, zone_id").fetchall()
+    finally:
+        conn.close()
+
+
+def add_supervisor(db_path: str, user_id: int, zone_id: int) -> bool:
+    """
+    Назначает пользователя куратором техзоны.
+
+    Новому куратору сводки отправляются начиная со следующей заявки,
+    без накопленной истории.
+
+    Returns:
+        bool: False, если пользователь уже куратор этой техзоны.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO supervisors (user_id, zone_id) "
+                "VALUES (?, ?)", (user_id, zone_id))
+            conn.execute(
+                "INSERT OR IGNORE INTO digest_watermark (user_id, report_id) "
+                "SELECT ?, COALESCE(MAX(id), 0) FROM driver_reports",
+                (user_id,))
+            return cursor.rowcount > 0
+    finally:
+        conn.close()
+
+
+def remove_supervisor(db_path: str, user_id: int, zone_id: int) -> bool:
+    """
+    Снимает пользователя с кураторства техзоны.
+
+    Returns:
+        bool: True, если пользователь был куратором этой техзоны.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            cursor = conn.execute(
+                "DELETE FROM supervisors WHERE user_id = ? AND zone_id = ?",
+                (user_id, zone_id))
+            conn.execute(
+                "DELETE FROM digest_watermark WHERE user_id = ? AND user_id "
+                "NOT IN (SELECT user_id FROM supervisors)", (user_id,))
+            return cursor.rowcount > 0
+    finally:
+        conn.close()
+
+
+def get_digest_watermark(db_path: str, user_id: int) -> int:
+    """Возвращает id последней заявки, отправленной куратору в сводке."""
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute(
+            "SELECT report_id FROM digest_watermark WHERE user_id = ?",
+            (user_id,)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else 0
+
+
+def set_digest_watermark(db_path: str, user_id: int, report_id: int) -> None:
+    """Запоминает id последней заявки, отправленной куратору в сводке."""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO digest_watermark (user_id, report_id) "
+            "VALUES (?, ?)", (user_id, report_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_last_report_id(db_path: str) -> int:
+    """Возвращает id последней сохраненной заявки."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM driver_reports").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def get_reports_after(db_path: str, report_id: int, last_id: int,
+                      zone_ids: list[int]) -> list[tuple]:
+    """
+    Возвращает заявки техзон zone_ids с id в диапазоне (report_id, last_id].
+
+    Returns:
+        list[tuple]: Кортежи (id, timestamp, zone, reason, gos_number,
+        full_address, photo_ids) в порядке id.
+    """
+    placeholders = ', '.join('?' * len(zone_ids))
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT id, timestamp, zone, reason, gos_number, full_address, "
+            "photo_ids FROM driver_reports WHERE id > ? AND id <= ? "
+            f"AND zone_id IN ({placeholders}) ORDER BY id",
+            (report_id, last_id, *zone_ids)).fetchall()
+    finally:
+        conn.close()
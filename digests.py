@@ -0,0 +1,252 @@
+"""
+Сводки заявок кураторам техзон.
+
+Раз в DIGEST_INTERVAL секунд каждый куратор получает одну сводку по
+заявкам своих техзон, сохраненным после предыдущей сводки: таблицу заявок
+и альбомы их фото. id последней заявки, вошедшей в сводку куратора,
+хранится в digest_watermark, поэтому после перезапуска бота заявки не
+теряются и не отправляются повторно.
+
+Сообщения сводок отправляются через RateLimiter, который держит темп
+отправки в пределах лимитов Telegram и выжидает RetryAfter.
+"""
+import asyncio
+import html
+import logging
+import time
+from datetime import datetime, timedelta
+
+from aiogram import Bot
+from aiogram.types import InputMediaPhoto
+from aiogram.utils.exceptions import (RetryAfter, BadRequest, ChatNotFound,
+                                      Unauthorized)
+
+from database_functions import (get_supervisors, get_digest_watermark,
+                                set_digest_watermark, get_last_report_id,
+                                get_reports_after)
+
+logger = logging.getLogger(__name__)
+
+# Максимум фото в одном альбоме Telegram
+ALBUM_SIZE = 10
+# Максимальная длина текста сообщения Telegram
+MESSAGE_LIMIT = 4096
+# Минимальная пауза между сообщениями в один чат, секунд
+CHAT_INTERVAL = 1.0
+
+
+class RateLimiter:
+    """
+    Ограничивает темп отправки сообщений.
+
+    Общий темп ограничивается корзиной токенов (token bucket), пауза между
+    сообщениями в один чат - CHAT_INTERVAL на каждое сообщение.
+
+    Args:
+        rate (float): Сообщений в секунду для всех чатов вместе.
+        max_retries (int): Сколько раз повторять отправку после RetryAfter.
+    """
+
+    def __init__(self, rate: float, max_retries: int = 3):
+        self.rate = rate
+        self.capacity = max(rate, ALBUM_SIZE)
+        self.max_retries = max_retries
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._chat_free_at: dict[int, float] = {}
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, chat_id: int, cost: int = 1) -> None:
+        """Ждет, пока можно отправить cost сообщений в чат."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens +
+                                   (now - self._updated) * self.rate)
+                self._updated = now
+                wait = max((cost - self._tokens) / self.rate,
+                           self._chat_free_at.get(chat_id, 0) - now)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self._tokens -= cost
+            self._chat_free_at[chat_id] = now + CHAT_INTERVAL * cost
+
+    async def send(self, chat_id: int, method, *args, cost: int = 1,
+                   **kwargs):
+        """
+        Вызывает метод бота method(chat_id, *args, **kwargs) с учетом темпа.
+
+        cost - количество сообщений, например число фото альбома.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(chat_id, cost)
+            try:
+                return await method(chat_id, *args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning("Telegram просит подождать %s с перед "
+                               "отправкой в чат %s", e.timeout, chat_id)
+                await asyncio.sleep(e.timeout)
+
+
+def format_report_lines(report: tuple, hours_offset: int,
+                        with_zone: bool) -> list[str]:
+    """Строки заявки в таблице сводки, with_zone - со строкой техзоны."""
+    report_id, timestamp, zone, reason, gos_number, address, _ = report
+    lines = [f"\n{zone}"] if with_zone else []
+    created_at = (datetime.fromtimestamp(timestamp) +
+                  timedelta(hours=hours_offset)).strftime('%d.%m %H:%M')
+    lines.append(f"{report_id:>6} {created_at} {gos_number or '':<9} "
+                 f"{reason}")
+    if address:
+        lines.append(f"{'':>19}{address}")
+    return lines
+
+
+def format_digest(reports: list[tuple],
+                  hours_offset: int) -> list[tuple[str, list[tuple]]]:
+    """
+    Формирует таблицу заявок сводки, разбитую на сообщения.
+
+    Returns:
+        list[tuple[str, list[tuple]]]: Текст сообщения в HTML не длиннее
+        MESSAGE_LIMIT и заявки, вошедшие в это сообщение.
+    """
+    chunks = []
+    text = f"Сводка заявок: {len(reports)}"
+    chunk_reports = []
+    zone = None
+    for report in reports:
+        lines = format_report_lines(report, hours_offset, report[2] != zone)
+        block = ''.join('\n' + line for line in lines)
+        if chunk_reports and len(text) + len(block) + 20 > MESSAGE_LIMIT:
+            chunks.append((text, chunk_reports))
+            # Новое сообщение начинается со строки техзоны
+            lines = format_report_lines(report, hours_offset, True)
+            text, chunk_reports = '', []
+            block = ''.join('\n' + line for line in lines)
+        text += block
+        chunk_reports.append(report)
+        zone = report[2]
+    chunks.append((text, chunk_reports))
+    return [(f"<pre>{html.escape(text.strip())}</pre>", chunk_reports)
+            for text, chunk_reports in chunks]
+
+
+def build_albums(reports: list[tuple]) -> list[list[InputMediaPhoto]]:
+    """Раскладывает фото заявок по альбомам не больше ALBUM_SIZE фото."""
+    media = []
+    for report_id, _, _, _, gos_number, _, photo_ids in reports:
+        for number, file_id in enumerate(filter(None,
+                                                (photo_ids or '').split(','))):
+            caption = f"№{report_id} {gos_number}" if number == 0 else None
+            media.append(InputMediaPhoto(file_id, caption=caption))
+    return [media[start:start + ALBUM_SIZE]
+            for start in range(0, len(media), ALBUM_SIZE)]
+
+
+async def send_part(tg_bot: Bot, limiter: RateLimiter, user_id: int,
+                    text: str, reports: list[tuple]) -> None:
+    """
+    Отправляет часть сводки: сообщение таблицы и альбомы фото заявок.
+
+    Сообщение или альбом, отклоненные Telegram, пропускаются.
+    """
+    try:
+        await limiter.send(user_id, tg_bot.send_message, text,
+                           parse_mode='HTML')
+    except ChatNotFound:
+        raise
+    except BadRequest as e:
+        logger.error("Telegram отклонил таблицу сводки куратору %s: %s",
+                     user_id, e)
+    for album in build_albums(reports):
+        try:
+            await limiter.send(user_id, tg_bot.send_media_group, album,
+                               cost=len(album))
+        except ChatNotFound:
+            raise
+        except BadRequest as e:
+            logger.error("Telegram отклонил альбом сводки куратору %s "
+                         "(заявки %s-%s): %s", user_id, reports[0][0],
+                         reports[-1][0], e)
+
+
+async def send_digest(tg_bot: Bot, limiter: RateLimiter, db_path: str,
+                      user_id: int, zone_ids: list[int], last_id: int,
+                      hours_offset: int) -> int:
+    """
+    Отправляет куратору сводку заявок его техзон до заявки last_id.
+
+    Сводка отправляется частями: сообщение таблицы и альбомы фото его
+    заявок. Граница сводки сдвигается после каждой части, поэтому при
+    ошибке повторно отправляются только неотправленные части.
+
+    Ошибки, которые не исчезнут при повторе, не останавливают сводку:
+    сообщение или альбом, отклоненные Telegram (например, устаревший
+    file_id фото), пропускаются, а если куратор заблокировал бота или чат
+    не найден, сводка пропускается целиком.
+
+    Returns:
+        int: Количество отправленных заявок.
+    """
+    watermark = get_digest_watermark(db_path, user_id)
+    reports = get_reports_after(db_path, watermark, last_id, zone_ids)
+    chunks = format_digest(reports, hours_offset) if reports else []
+    sent = 0
+    for text, chunk_reports in chunks:
+        try:
+            await send_part(tg_bot, limiter, user_id, text, chunk_reports)
+        except (Unauthorized, ChatNotFound) as e:
+            logger.warning("Сводка куратору %s не отправлена: %s",
+                           user_id, e)
+            break
+        sent += len(chunk_reports)
+        set_digest_watermark(db_path, user_id, chunk_reports[-1][0])
+    set_digest_watermark(db_path, user_id, last_id)
+    return sent
+
+
+async def send_digests(tg_bot: Bot, limiter: RateLimiter, db_path: str,
+                       hours_offset: int) -> int:
+    """
+    Отправляет сводки всем кураторам.
+
+    Заявки выбираются по id техзоны, поэтому переименование техзоны не
+    влияет на сводки. Отключенные техзоны тоже входят в сводку: их заявки,
+    сохраненные до отключения, иначе были бы пропущены.
+
+    Returns:
+        int: Количество заявок во всех отправленных сводках.
+    """
+    zones_by_user: dict[int, list[int]] = {}
+    for user_id, zone_id in get_supervisors(db_path):
+        zones_by_user.setdefault(user_id, []).append(zone_id)
+
+    # Заявки, сохраненные во время рассылки, войдут в следующую сводку
+    last_id = get_last_report_id(db_path)
+    sent = 0
+    for user_id, zone_ids in zones_by_user.items():
+        try:
+            sent += await send_digest(tg_bot, limiter, db_path, user_id,
+                                      zone_ids, last_id, hours_offset)
+        except Exception as e:
+            logger.error("Ошибка при отправке сводки куратору %s: %s",
+                         user_id, e)
+    return sent
+
+
+async def digest_loop(tg_bot: Bot, db_path: str, interval: int,
+                      rate: float, hours_offset: int) -> None:
+    """Периодически отправляет сводки кураторам."""
+    limiter = RateLimiter(rate)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            sent = await send_digests(tg_bot, limiter, db_path, hours_offset)
+            if sent:
+                logger.info("Отправлены сводки, заявок: %s", sent)
+        except Exception as e:
+            logger.error("Ошибка при отправке сводок: %s", e)
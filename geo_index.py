@@ -0,0 +1,351 @@
+"""
+Пространственный индекс техзон.
+
+Для каждой техзоны может быть задан прямоугольник границ (bounding box).
+Прямоугольники раскладываются по ячейкам регулярной сетки, поэтому поиск
+зон, содержащих точку, проверяет только зоны одной ячейки.
+
+Точные границы техзон загружаются из GeoJSON файла в PolygonIndex. Ребра
+каждого полигона заранее разложены по горизонтальным полосам, и проверка
+точки (метод луча) перебирает только ребра ее полосы.
+
+Переопределение техзон сохраненных заявок по границам из GeoJSON и
+сверка индекса полигонов с полным перебором ребер на случайных точках:
+    python geo_index.py database/users.db zones.geojson
+    python geo_index.py database/users.db zones.geojson --apply
+    python geo_index.py database/users.db zones.geojson --check 100000
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import sqlite3
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Размер ячейки сетки в градусах
+CELL_SIZE = 0.5
+
+
+class BoundingBox(NamedTuple):
+    """Прямоугольник границ техзоны в градусах."""
+    min_lat: float
+    min_lon: float
+    max_lat: float
+    max_lon: float
+
+    def contains(self, latitude: float, longitude: float) -> bool:
+        return (self.min_lat <= latitude <= self.max_lat and
+                self.min_lon <= longitude <= self.max_lon)
+
+    def is_valid(self) -> bool:
+        """Проверяет, что углы не перепутаны и лежат в пределах координат."""
+        return (-90 <= self.min_lat <= self.max_lat <= 90 and
+                -180 <= self.min_lon <= self.max_lon <= 180)
+
+
+def get_cell(latitude: float, longitude: float,
+             cell_size: float = CELL_SIZE) -> tuple[int, int]:
+    """Возвращает ячейку сетки, в которую попадает точка."""
+    return (math.floor(latitude / cell_size),
+            math.floor(longitude / cell_size))
+
+
+class ZoneIndex:
+    """
+    Индекс прямоугольников границ техзон.
+
+    Args:
+        boxes (dict[int, BoundingBox]): Границы по id техзоны.
+        cell_size (float): Размер ячейки сетки в градусах.
+    """
+
+    def __init__(self, boxes: dict[int, BoundingBox],
+                 cell_size: float = CELL_SIZE):
+        self.boxes = boxes
+        self.cell_size = cell_size
+        self._cells: dict[tuple[int, int], list[int]] = {}
+        for zone_id, box in boxes.items():
+            min_row, min_col = get_cell(box.min_lat, box.min_lon, cell_size)
+            max_row, max_col = get_cell(box.max_lat, box.max_lon, cell_size)
+            for row in range(min_row, max_row + 1):
+                for col in range(min_col, max_col + 1):
+                    self._cells.setdefault((row, col), []).append(zone_id)
+
+    def has_bounds(self, zone_id: int) -> bool:
+        """Проверяет, заданы ли границы техзоны."""
+        return zone_id in self.boxes
+
+    def contains(self, zone_id: int, latitude: float,
+                 longitude: float) -> bool:
+        """
+        Проверяет, попадает ли точка в границы техзоны.
+
+        Для техзоны без границ всегда возвращает True.
+        """
+        box = self.boxes.get(zone_id)
+        return box is None or box.contains(latitude, longitude)
+
+    def find(self, latitude: float, longitude: float) -> list[int]:
+        """Возвращает id техзон, в границы которых попадает точка."""
+        cell = get_cell(latitude, longitude, self.cell_size)
+        return [zone_id for zone_id in self._cells.get(cell, [])
+                if self.boxes[zone_id].contains(latitude, longitude)]
+
+
+# Количество горизонтальных полос, по которым раскладываются ребра полигона
+POLYGON_BANDS = 64
+
+
+class ZonePolygon:
+    """
+    Граница техзоны: один или несколько полигонов, возможно с дырами.
+
+    Args:
+        name (str): Название техзоны, как в справочнике.
+        rings (list[list[tuple[float, float]]]): Кольца в координатах
+            (долгота, широта), как в GeoJSON.
+    """
+
+    def __init__(self, name: str, rings: list[list[tuple[float, float]]]):
+        self.name = name
+        self.rings = rings
+        points = [point for ring in rings for point in ring]
+        self.box = BoundingBox(min(lat for _, lat in points),
+                               min(lon for lon, _ in points),
+                               max(lat for _, lat in points),
+                               max(lon for lon, _ in points))
+        self._band_height = ((self.box.max_lat - self.box.min_lat) /
+                             POLYGON_BANDS) or 1.0
+        # Ребро: (широта начала, широта конца, долгота начала, наклон)
+        self._bands: list[list[tuple]] = [[] for _ in range(POLYGON_BANDS)]
+        for ring in rings:
+            for (lon1, lat1), (lon2, lat2) in zip(ring, ring[1:] + ring[:1]):
+                if lat1 == lat2:
+                    continue
+                edge = (lat1, lat2, lon1, (lon2 - lon1) / (lat2 - lat1))
+                for band in range(self._band(min(lat1, lat2)),
+                                  self._band(max(lat1, lat2)) + 1):
+                    self._bands[band].append(edge)
+
+    def _band(self, latitude: float) -> int:
+        band = int((latitude - self.box.min_lat) / self._band_height)
+        return min(max(band, 0), POLYGON_BANDS - 1)
+
+    def contains(self, latitude: float, longitude: float) -> bool:
+        """Проверяет попадание точки в полигон методом луча."""
+        if not self.box.contains(latitude, longitude):
+            return False
+        inside = False
+        for lat1, lat2, lon1, slope in self._bands[self._band(latitude)]:
+            if ((lat1 > latitude) != (lat2 > latitude) and
+                    longitude < lon1 + (latitude - lat1) * slope):
+                inside = not inside
+        return inside
+
+
+class PolygonIndex:
+    """Индекс полигонов техзон на сетке ячеек."""
+
+    def __init__(self, polygons: list[ZonePolygon],
+                 cell_size: float = CELL_SIZE):
+        self.polygons = polygons
+        self.cell_size = cell_size
+        self._cells: dict[tuple[int, int], list[ZonePolygon]] = {}
+        for polygon in polygons:
+            box = polygon.box
+            min_row, min_col = get_cell(box.min_lat, box.min_lon, cell_size)
+            max_row, max_col = get_cell(box.max_lat, box.max_lon, cell_size)
+            for row in range(min_row, max_row + 1):
+                for col in range(min_col, max_col + 1):
+                    self._cells.setdefault((row, col), []).append(polygon)
+
+    def __bool__(self) -> bool:
+        return bool(self.polygons)
+
+    def find(self, latitude: float, longitude: float) -> str | None:
+        """Возвращает название техзоны, содержащей точку, или None."""
+        cell = get_cell(latitude, longitude, self.cell_size)
+        for polygon in self._cells.get(cell, []):
+            if polygon.contains(latitude, longitude):
+                return polygon.name
+        return None
+
+    def find_many(self, points: list[tuple[float, float]]
+                  ) -> list[str | None]:
+        """
+        Определяет техзоны для набора точек (широта, долгота).
+
+        Точки группируются по ячейкам сетки, и каждая группа проверяется
+        только по полигонам своей ячейки.
+        """
+        result = [None] * len(points)
+        groups: dict[tuple[int, int], list[int]] = {}
+        for number, (latitude, longitude) in enumerate(points):
+            groups.setdefault(get_cell(latitude, longitude, self.cell_size),
+                              []).append(number)
+        for cell, numbers in groups.items():
+            for polygon in self._cells.get(cell, []):
+                for number in numbers:
+                    if result[number] is None and polygon.contains(
+                            *points[number]):
+                        result[number] = polygon.name
+        return result
+
+
+def read_geojson(path: str) -> list[ZonePolygon]:
+    """
+    Читает границы техзон из GeoJSON (FeatureCollection).
+
+    Название техзоны берется из свойства name объекта, объекты без него
+    пропускаются. Поддерживаются геометрии Polygon и MultiPolygon.
+    """
+    with open(path, encoding='utf-8') as file:
+        collection = json.load(file)
+    polygons = []
+    for feature in collection.get('features', []):
+        geometry = feature.get('geometry') or {}
+        name = (feature.get('properties') or {}).get('name')
+        if not name:
+            logger.warning("Объект без названия техзоны в %s пропущен", path)
+            continue
+        if geometry.get('type') == 'Polygon':
+            parts = [geometry['coordinates']]
+        elif geometry.get('type') == 'MultiPolygon':
+            parts = geometry['coordinates']
+        else:
+            continue
+        rings = [[tuple(point[:2]) for point in ring]
+                 for part in parts for ring in part]
+        polygons.append(ZonePolygon(name, rings))
+    return polygons
+
+
+_polygon_index = PolygonIndex([])
+
+
+def get_polygon_index() -> PolygonIndex:
+    """Возвращает загруженный индекс полигонов техзон."""
+    return _polygon_index
+
+
+def load_polygon_index(path: str) -> PolygonIndex:
+    """Загружает границы техзон из GeoJSON, если файл есть."""
+    global _polygon_index
+    polygons = read_geojson(path) if os.path.exists(path) else []
+    _polygon_index = PolygonIndex(polygons)
+    return _polygon_index
+
+
+def reclassify_reports(db_path: str, index: PolygonIndex,
+                       apply: bool = False) -> dict[tuple[str, str], int]:
+    """
+    Сравнивает техзоны сохраненных заявок с границами из индекса.
+
+    Args:
+        apply (bool): Записать найденные по границам техзоны в driver_reports.
+
+    Returns:
+        dict[tuple[str, str], int]: Количество заявок по паре
+        (техзона в заявке, техзона по границам) для расхождений.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT id, zone, latitude, longitude FROM driver_reports "
+            "WHERE latitude IS NOT NULL AND longitude IS NOT NULL").fetchall()
+        detected = index.find_many([(row[2], row[3]) for row in rows])
+        changes = [(zone, row[0]) for row, zone in zip(rows, detected)
+                   if zone is not None and zone != row[1]]
+        summary = {}
+        for row, zone in zip(rows, detected):
+            if zone is not None and zone != row[1]:
+                summary[(row[1], zone)] = summary.get((row[1], zone), 0) + 1
+        if apply and changes:
+            with conn:
+                conn.executemany(
+                    "UPDATE driver_reports SET zone = ?, zone_id = COALESCE("
+                    "(SELECT MIN(id) FROM zones WHERE title = ?1), zone_id) "
+                    "WHERE id = ?", changes)
+    finally:
+        conn.close()
+    return summary
+
+
+def contains_by_rings(rings: list[list[tuple[float, float]]],
+                      latitude: float, longitude: float) -> bool:
+    """Метод луча по всем ребрам колец, без полос и прямоугольника."""
+    inside = False
+    for ring in rings:
+        for (lon1, lat1), (lon2, lat2) in zip(ring, ring[1:] + ring[:1]):
+            if ((lat1 > latitude) != (lat2 > latitude) and
+                    longitude < lon1 + (latitude - lat1) * (lon2 - lon1) /
+                    (lat2 - lat1)):
+                inside = not inside
+    return inside
+
+
+def check_polygon_index(index: PolygonIndex, samples: int,
+                        seed: int = 0) -> list[tuple[float, float]]:
+    """
+    Сверяет поиск техзон индексом с полным перебором полигонов.
+
+    Точки выбираются случайно внутри общего прямоугольника полигонов.
+
+    Returns:
+        list[tuple[float, float]]: Точки (широта, долгота), для которых
+        find или find_many дают другую техзону, чем перебор.
+    """
+    if not index:
+        return []
+    generator = random.Random(seed)
+    min_lat = min(polygon.box.min_lat for polygon in index.polygons)
+    min_lon = min(polygon.box.min_lon for polygon in index.polygons)
+    max_lat = max(polygon.box.max_lat for polygon in index.polygons)
+    max_lon = max(polygon.box.max_lon for polygon in index.polygons)
+    points = [(generator.uniform(min_lat, max_lat),
+               generator.uniform(min_lon, max_lon)) for _ in range(samples)]
+    found_many = index.find_many(points)
+    mismatches = []
+    for point, zone in zip(points, found_many):
+        expected = next((polygon.name for polygon in index.polygons
+                         if contains_by_rings(polygon.rings, *point)), None)
+        if index.find(*point) != expected or zone != expected:
+            mismatches.append(point)
+    return mismatches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Переопределение техзон заявок по границам из GeoJSON')
+    parser.add_argument('db_path')
+    parser.add_argument('geojson_path')
+    parser.add_argument('--apply', action='store_true',
+                        help='записать новые техзоны в базу')
+    parser.add_argument('--check', type=int, metavar='N',
+                        help='сверить индекс с перебором на N точках, '
+                             'база не читается')
+    args = parser.parse_args()
+
+    index = PolygonIndex(read_geojson(args.geojson_path))
+    if args.check:
+        mismatches = check_polygon_index(index, args.check)
+        for latitude, longitude in mismatches[:20]:
+            print(f"Расхождение: {latitude:.6f}, {longitude:.6f}")
+        print(f"Точек: {args.check}, расхождений: {len(mismatches)}")
+        raise SystemExit(1 if mismatches else 0)
+    summary = reclassify_reports(args.db_path, index, args.apply)
+    if not summary:
+        print('Расхождений нет')
+    for (old, new), count in sorted(summary.items(),
+                                    key=lambda item: -item[1]):
+        print(f"{count:>6}  {old} -> {new}")
+    if args.apply:
+        print(f"Обновлено заявок: {sum(summary.values())}")
+
+
+if __name__ == '__main__':
+    main()
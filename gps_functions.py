@@ -1,28 +1,64 @@
 import requests
 
+from regexpes import coordinates_re
+
+GEOCODE_TIMEOUT = 10
+GEOCODE_URL = "https://api.geoapify.com/v1/geocode/reverse"
+ADDRESS_KEYS = ['formatted', 'city', 'county', 'district', 'suburb', 'street',
+                'housenumber']
+
+# Общая сессия держит соединение с сервисом открытым между запросами
+session = requests.Session()
+
+
 def get_address_from_coordinates(latitude, longitude, apikey):
-    url = "https://api.geoapify.com/v1/geocode/reverse"
+    """
+    Возвращает свойства адреса по координатам.
+
+    Raises:
+        requests.RequestException: Если сервис не ответил или вернул ошибку.
+    """
     params = {
         "lat": latitude,
         "lon": longitude,
         "apiKey": apikey,
         "lang": "ru"
     }
-    response = requests.get(url, params=params)
-    if response.status_code == 200:
-        data = response.json()
-        features = data.get("features", [])
-        if features:
-            return features[0]["properties"]
-        return "Адрес не найден"
-    return f"Ошибка: {response.status_code}"
+    response = session.get(GEOCODE_URL, params=params, timeout=GEOCODE_TIMEOUT)
+    response.raise_for_status()
+    data = response.json()
+    features = data.get("features", [])
+    if features:
+        return features[0]["properties"]
+    return {}
+
+
+def parse_coordinates(text: str) -> tuple[float, float] | None:
+    """
+    Разбирает координаты, написанные текстом.
+
+    Returns:
+        tuple[float, float] | None: Широта и долгота или None, если текст
+        не похож на координаты.
+    """
+    match = coordinates_re.match(text)
+    if not match:
+        return None
+    latitude, longitude = (float(value.replace(',', '.'))
+                           for value in match.groups())
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+
+def warm_up_geocoder() -> None:
+    """Устанавливает соединение с сервисом адресов заранее."""
+    session.head(GEOCODE_URL, timeout=GEOCODE_TIMEOUT)
 
 
 def parse_data_from_gps_dict(gps_dict: dict) -> dict:
     """Разбирает полученные от gps библиотеки данные."""
     result = {}
-    keys = ['formatted', 'city', 'county', 'district', 'suburb', 'street',
-            'housenumber']
-    for key in keys:
+    for key in ADDRESS_KEYS:
         result[key] = gps_dict.get(key, f'{key} не найдено')
     return result
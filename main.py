@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from random import choice
 
@@ -11,19 +12,39 @@ from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from dotenv import load_dotenv
 
 from FSM_Classes import RegistrationStates, DriverReport
+from geo_index import BoundingBox, get_polygon_index, load_polygon_index
+from middlewares import AlbumMiddleware, JournalMiddleware
 from bots_func import (get_main_menu, get_cancel,
                        get_location_keyboard,
                        get_confirmation_keyboard,
                        get_reason_keyboard,
-                       get_zone_keyboard, get_reason_full_text,
-                       save_user_data)
+                       get_zone_keyboard, parse_callback_id,
+                       save_user_data, pending_reports_loop)
+from catalog import (get_catalog, load_catalog, add_item, rename_item,
+                     remove_item, set_bounds)
 from database_functions import is_user_registered, register_user, is_admin, \
-    ban_user, is_user_banned
-from regexpes import gos_number_re, phone_number_re
+    ban_user, is_user_banned, get_supervisors, add_supervisor, \
+    remove_supervisor
+from digests import digest_loop
+from gps_functions import parse_coordinates
+from regexpes import gos_number_re, phone_number_re, coordinates_re
 
 from settings import (text_message_answers, DEV_TG_ID, database_path, log_file,
-                      zones, reasons, API_TOKEN)
+                      zones, reasons, API_TOKEN, PENDING_RETRY_INTERVAL,
+                      REPORTS_RETENTION_DAYS, ARCHIVE_FOLDER,
+                      MAINTENANCE_INTERVAL, REPORT_STATS,
+                      STATS_PERSIST_INTERVAL, MAX_REPORT_PHOTOS,
+                      LIVE_LOCATION_SETTLE, ZONES_GEOJSON,
+                      UPDATE_JOURNAL_FOLDER, UPDATE_JOURNAL_MAX_BYTES,
+                      UPDATE_JOURNAL_SECRET, DIGEST_INTERVAL, DIGEST_RATE,
+                      TIMEDELTA, TRACES_FLUSH_INTERVAL)
+from stats import stats_persist_loop
+from storage_maintenance import maintenance_loop
 from textes_for_messages import new_user, reg_keyboard, start_process
+from tracing import (init_traces_db, new_trace_id, traced_step,
+                     spans_flush_loop, flush_spans)
+from update_journal import JournalWriter
+from warmup import warm_up
 
 load_dotenv()
 
@@ -47,6 +68,19 @@ storage = MemoryStorage()
 dp = Dispatcher(bot, storage=storage)
 
 dp.middleware.setup(LoggingMiddleware())
+dp.middleware.setup(AlbumMiddleware())
+if UPDATE_JOURNAL_FOLDER:
+    dp.middleware.setup(JournalMiddleware(JournalWriter(
+        UPDATE_JOURNAL_FOLDER, UPDATE_JOURNAL_MAX_BYTES,
+        UPDATE_JOURNAL_SECRET)))
+
+snapshot = load_catalog(database_path, zones, reasons)
+polygon_index = load_polygon_index(ZONES_GEOJSON)
+for polygon in polygon_index.polygons:
+    if snapshot.get_zone_by_title(polygon.name) is None:
+        logger.warning("Границы из %s для неизвестной техзоны: %s",
+                       ZONES_GEOJSON, polygon.name)
+init_traces_db()
 
 
 ###############################################################################
@@ -83,13 +117,162 @@ async def message_ban_user(message: types.Message):
         await message.reply("Неизвестная команда")
 
 
+CATALOG_COMMANDS = {
+    'zone': 'zones',
+    'reason': 'reasons',
+}
+
+
+@dp.message_handler(commands=['zones', 'reasons'])
+async def show_catalog(message: types.Message):
+    """
+    Отрабатывает команды /zones и /reasons, показывает справочник с id.
+    """
+    if not is_admin(database_path, message.from_user.id):
+        await message.reply("Неизвестная команда")
+        return
+    catalog = get_catalog()
+    items = (catalog.zones if message.get_command(pure=True) == 'zones'
+             else catalog.reasons)
+    lines = [f"{item.id}: {item.title}" for item in items]
+    await message.reply(f"Версия справочников {catalog.version}\n" +
+                        "\n".join(lines))
+
+
+@dp.message_handler(commands=['zone_bounds'])
+async def edit_zone_bounds(message: types.Message):
+    """
+    Отрабатывает команду /zone_bounds id min_lat min_lon max_lat max_lon.
+
+    /zone_bounds id без координат сбрасывает границы техзоны.
+    """
+    if not is_admin(database_path, message.from_user.id):
+        await message.reply("Неизвестная команда")
+        return
+    try:
+        zone_id, *values = message.get_args().split()
+        bounds = BoundingBox(*map(float, values)) if values else None
+        zone_id = int(zone_id)
+    except (TypeError, ValueError):
+        await message.reply("Неверные аргументы команды")
+        return
+    if bounds is not None and not bounds.is_valid():
+        await message.reply("Неверные границы: нужны min_lat min_lon "
+                            "max_lat max_lon, минимум не больше максимума, "
+                            "широта от -90 до 90, долгота от -180 до 180")
+        return
+    result = set_bounds(database_path, zone_id, bounds)
+    await message.reply(f"zones bounds result {result}, "
+                        f"версия {get_catalog().version}")
+
+
+@dp.message_handler(commands=['zone_add', 'zone_del', 'zone_rename',
+                              'reason_add', 'reason_del', 'reason_rename'])
+async def edit_catalog(message: types.Message):
+    """
+    Отрабатывает команды правки справочников.
+
+    /zone_add название, /zone_del id, /zone_rename id название,
+    аналогично для reason.
+    """
+    if not is_admin(database_path, message.from_user.id):
+        await message.reply("Неизвестная команда")
+        return
+    kind, action = message.get_command(pure=True).split('_')
+    table = CATALOG_COMMANDS[kind]
+    args = message.get_args().strip()
+    try:
+        if action == 'add':
+            if not args:
+                raise ValueError
+            result = add_item(database_path, table, args)
+        elif action == 'del':
+            result = remove_item(database_path, table, int(args))
+        else:
+            item_id, title = args.split(' ', 1)
+            result = rename_item(database_path, table, int(item_id),
+                                 title.strip())
+    except ValueError:
+        await message.reply("Неверные аргументы команды")
+        return
+    await message.reply(f"{table} {action} result {result}, "
+                        f"версия {get_catalog().version}")
+
+
+@dp.message_handler(commands=['supervisors'])
+async def show_supervisors(message: types.Message):
+    """
+    Отрабатывает команду /supervisors, показывает кураторов техзон.
+    """
+    if not is_admin(database_path, message.from_user.id):
+        await message.reply("Неизвестная команда")
+        return
+    catalog = get_catalog()
+    lines = []
+    for user_id, zone_id in get_supervisors(database_path):
+        zone = catalog.get_zone(zone_id)
+        lines.append(f"{user_id}: {zone_id} "
+                     f"{zone.title if zone else '(техзона отключена)'}")
+    await message.reply("\n".join(lines) or "Кураторы не назначены")
+
+
+@dp.message_handler(commands=['supervisor_add', 'supervisor_del'])
+async def edit_supervisors(message: types.Message):
+    """
+    Отрабатывает команды /supervisor_add user_id zone_id и
+    /supervisor_del user_id zone_id.
+
+    Куратор получает сводки заявок техзоны, если он запускал бота.
+    """
+    if not is_admin(database_path, message.from_user.id):
+        await message.reply("Неизвестная команда")
+        return
+    action = message.get_command(pure=True).split('_')[1]
+    try:
+        user_id, zone_id = map(int, message.get_args().split())
+    except ValueError:
+        await message.reply("Неверные аргументы команды")
+        return
+    if action == 'add':
+        if get_catalog().get_zone(zone_id) is None:
+            await message.reply("Техзона не найдена")
+            return
+        result = add_supervisor(database_path, user_id, zone_id)
+    else:
+        result = remove_supervisor(database_path, user_id, zone_id)
+    await message.reply(f"supervisors {action} result {result}")
+
+
+STATS_COMMANDS = {
+    'stats': REPORT_STATS.summary,
+    'stats_zones': REPORT_STATS.zones_text,
+    'stats_reasons': REPORT_STATS.reasons_text,
+    'stats_errors': REPORT_STATS.errors_text,
+}
+
+
+@dp.message_handler(commands=list(STATS_COMMANDS))
+async def show_stats(message: types.Message):
+    """
+    Отрабатывает команды /stats, /stats_zones, /stats_reasons, /stats_errors.
+
+    Ответ формируется из счетчиков в памяти, без запросов к базе заявок.
+    """
+    if not is_admin(database_path, message.from_user.id):
+        await message.reply("Неизвестная команда")
+        return
+    await message.reply(STATS_COMMANDS[message.get_command(pure=True)]())
+
+
 @dp.callback_query_handler(Text(equals="cancel"), state="*")
+@traced_step('cancel')
 async def cancel_callback(callback_query: types.CallbackQuery, state: FSMContext):
     """Обрабатывает отмену через callback-кнопку."""
     await process_cancel(event=callback_query, state=state)
 
 
 @dp.message_handler(Command("cancel"), state="*")
+@traced_step('cancel')
 async def cancel_command(message: types.Message, state: FSMContext):
     """Обрабатывает отмену через команду /cancel."""
     await process_cancel(event=message, state=state)
@@ -236,68 +419,217 @@ async def confirm_registration(callback_query: types.CallbackQuery,
 ##############################################################################
 
 @dp.callback_query_handler(lambda callback: callback.data == "driver_report")
-async def start_report(callback: types.CallbackQuery):
+@traced_step('start_report')
+async def start_report(callback: types.CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     if is_user_registered(database_path, user_id):
-        await callback.message.answer("Выберите Технологическую зону:",
-                                      reply_markup=get_zone_keyboard(zones))
+        await callback.message.answer(
+            "Выберите Технологическую зону:",
+            reply_markup=get_zone_keyboard(get_catalog()))
         await DriverReport.waiting_for_zone.set()
+        await state.update_data(trace_id=new_trace_id())
     else:
         await callback.message.answer(new_user,
                                       reply_markup=reg_keyboard)
 
 
 @dp.callback_query_handler(state=DriverReport.waiting_for_zone)
+@traced_step('zone')
 async def process_zone(callback: types.CallbackQuery, state: FSMContext):
-    zone = callback.data.split(":")[1]
+    catalog = get_catalog()
+    zone = catalog.get_zone(parse_callback_id(callback.data))
+    if zone is None:
+        await callback.message.answer(
+            "Список зон обновился, выберите зону еще раз:",
+            reply_markup=get_zone_keyboard(catalog))
+        return
     await state.update_data(user_id=callback.from_user.id)
-    await state.update_data(zone=zone)
-    await callback.message.answer("Отправьте геолокацию",
-                                  reply_markup=get_location_keyboard())
+    await state.update_data(zone=zone.title, zone_id=zone.id)
+
+    # Геопозиция уже получена, но не подошла к ранее выбранной зоне
+    user_data = await state.get_data()
+    if 'latitude' in user_data and catalog.zone_index.contains(
+            zone.id, user_data['latitude'], user_data['longitude']):
+        await ask_reason(callback.message, state)
+        return
+    await callback.message.answer(
+        "Отправьте геолокацию кнопкой ниже или напишите координаты, "
+        "например: 56.0153, 92.8932",
+        reply_markup=get_location_keyboard())
     await DriverReport.waiting_for_location.set()
 
 
-@dp.message_handler(content_types=['location'],
-                    state=DriverReport.waiting_for_location)
-async def process_location(message: types.Message, state: FSMContext):
-    latitude = message.location.latitude
-    longitude = message.location.longitude
-    await state.update_data(latitude=latitude)
-    await state.update_data(longitude=longitude)
+async def ask_reason(message: types.Message, state: FSMContext):
+    """Переводит заявку к выбору причины."""
     await message.answer("Идем дальше",
                          reply_markup=types.ReplyKeyboardRemove())
+    await message.answer("Выберите причину:",
+                         reply_markup=get_reason_keyboard(get_catalog()))
+    await state.set_state(DriverReport.waiting_for_reason)
+
+
+async def accept_location(message: types.Message, state: FSMContext,
+                          latitude: float, longitude: float):
+    """
+    Сохраняет координаты и проверяет их по границам выбранной техзоны.
+
+    Если точка попадает в полигон техзоны из ZONES_GEOJSON, техзона
+    заявки заменяется найденной. Иначе точка проверяется по прямоугольнику
+    границ выбранной техзоны, и если она вне границ, водитель выбирает зону
+    заново, а координаты запоминаются и повторно не запрашиваются.
+    """
+    await state.update_data(latitude=latitude, longitude=longitude)
+    user_data = await state.get_data()
+    catalog = get_catalog()
+    detected = catalog.get_zone_by_title(
+        get_polygon_index().find(latitude, longitude))
+    if detected is not None:
+        if detected.id != user_data.get('zone_id'):
+            await state.update_data(zone=detected.title, zone_id=detected.id)
+            await message.answer(
+                f"По геопозиции техзона определена как «{detected.title}»")
+        await ask_reason(message, state)
+        return
+
+    if catalog.zone_index.contains(user_data.get('zone_id'), latitude,
+                                   longitude):
+        await ask_reason(message, state)
+        return
+
+    text = (f"Геопозиция {latitude}, {longitude} вне границ техзоны "
+            f"«{user_data['zone']}».")
+    suggested = [catalog.get_zone(zone_id).title
+                 for zone_id in catalog.zone_index.find(latitude, longitude)]
+    if suggested:
+        text += f" Похоже, это: {', '.join(suggested)}."
+    await message.answer(text + " Выберите техзону еще раз:",
+                         reply_markup=get_zone_keyboard(catalog))
+    await state.set_state(DriverReport.waiting_for_zone)
+
+
+# Последние координаты трансляций геопозиции по (chat_id, user_id)
+live_locations: dict[tuple[int, int], tuple[float, float]] = {}
+
+
+async def settle_live_location(message: types.Message, state: FSMContext,
+                               key: tuple[int, int]):
+    """
+    Принимает последнюю точку трансляции после паузы.
+
+    Выполняется в отдельной задаче, поэтому ошибки записываются в лог
+    здесь, а водитель получает просьбу отправить геопозицию еще раз.
+    """
     try:
-        await message.answer("Выберите причину:",
-                             reply_markup=get_reason_keyboard(reasons=reasons))
+        await asyncio.sleep(LIVE_LOCATION_SETTLE)
+        latitude, longitude = live_locations.pop(key)
+        if await state.get_state() == DriverReport.waiting_for_location.state:
+            await accept_location(message, state, latitude, longitude)
     except Exception as e:
-        print(e)
-    await DriverReport.waiting_for_reason.set()
+        live_locations.pop(key, None)
+        logger.error("Ошибка при приеме трансляции геопозиции %s: %s", key, e)
+        try:
+            await message.answer("Не удалось принять геопозицию, "
+                                 "отправьте ее еще раз",
+                                 reply_markup=get_location_keyboard())
+        except Exception as e:
+            logger.error("Не удалось сообщить водителю %s об ошибке: %s",
+                         key, e)
+
+
+@dp.message_handler(content_types=[types.ContentType.LOCATION,
+                                   types.ContentType.VENUE],
+                    state=DriverReport.waiting_for_location)
+@traced_step('location')
+async def process_location(message: types.Message, state: FSMContext):
+    """
+    Принимает геопозицию, место (venue) или трансляцию геопозиции.
+
+    Трансляция обновляется каждые несколько секунд, поэтому обновления
+    только запоминаются, а используется точка на момент окончания паузы
+    LIVE_LOCATION_SETTLE.
+    """
+    location = message.location or message.venue.location
+    if location.live_period:
+        key = (message.chat.id, message.from_user.id)
+        started = key in live_locations
+        live_locations[key] = (location.latitude, location.longitude)
+        if not started:
+            await message.answer("Получаю трансляцию геопозиции, "
+                                 f"подождите {LIVE_LOCATION_SETTLE} с...")
+            asyncio.create_task(settle_live_location(message, state, key))
+        return
+    await accept_location(message, state, location.latitude,
+                          location.longitude)
+
+
+@dp.edited_message_handler(content_types=[types.ContentType.LOCATION],
+                           state=DriverReport.waiting_for_location)
+async def update_live_location(message: types.Message):
+    """Запоминает новую точку трансляции геопозиции."""
+    key = (message.chat.id, message.from_user.id)
+    if key in live_locations:
+        live_locations[key] = (message.location.latitude,
+                               message.location.longitude)
+
+
+@dp.message_handler(state=DriverReport.waiting_for_location,
+                    regexp=coordinates_re)
+@traced_step('location')
+async def process_typed_location(message: types.Message, state: FSMContext):
+    """Принимает координаты, написанные текстом."""
+    coordinates = parse_coordinates(message.text)
+    if coordinates is None:
+        await check_location(message)
+        return
+    await accept_location(message, state, *coordinates)
+
+
+@dp.message_handler(state=DriverReport.waiting_for_location)
+async def check_location(message: types.Message):
+    """Отрабатывает, если вместо геопозиции прислали что-то другое."""
+    await message.answer(
+        "Отправьте геолокацию кнопкой ниже или напишите координаты, "
+        "например: 56.0153, 92.8932",
+        reply_markup=get_location_keyboard())
 
 
 @dp.callback_query_handler(
     lambda callback: callback.data.startswith("reason:"),
     state=DriverReport.waiting_for_reason)
+@traced_step('reason')
 async def process_reason(callback: types.CallbackQuery, state: FSMContext):
-    reason_callback = callback.data.split(":")[1]
-    reason = get_reason_full_text(reasons, reason_callback)
-    await state.update_data(reason=reason)
-    await callback.message.answer("Пришлите фото:", reply_markup=get_cancel())
+    catalog = get_catalog()
+    reason = catalog.get_reason(parse_callback_id(callback.data))
+    if reason is None:
+        await callback.message.answer(
+            "Список причин обновился, выберите причину еще раз:",
+            reply_markup=get_reason_keyboard(catalog))
+        return
+    await state.update_data(reason=reason.title)
+    await callback.message.answer(
+        "Пришлите фото. Если фото несколько, отправьте их одним альбомом:",
+        reply_markup=get_cancel())
     await DriverReport.waiting_for_photo.set()
 
 
 @dp.callback_query_handler(lambda callback: callback.data.startswith("page:"),
                            state=DriverReport.waiting_for_reason)
+@traced_step('reason_page')
 async def change_reason_page(callback: types.CallbackQuery):
     page = int(callback.data.split(":")[1])
     await callback.message.edit_reply_markup(
-        reply_markup=get_reason_keyboard(reasons=reasons, page=page))
+        reply_markup=get_reason_keyboard(get_catalog(), page))
 
 
 @dp.message_handler(content_types=['photo'],
                     state=DriverReport.waiting_for_photo)
-async def process_photo(message: types.Message, state: FSMContext):
-    photo_id = message.photo[-1].file_id
-    await state.update_data(photo=photo_id)
+@traced_step('photo')
+async def process_photo(message: types.Message, state: FSMContext,
+                        album: list[types.Message] | None = None):
+    """Принимает одно фото или альбом фото."""
+    messages = album or [message]
+    photos = [item.photo[-1].file_id for item in messages if item.photo]
+    await state.update_data(photos=photos[:MAX_REPORT_PHOTOS])
     await message.answer(
         "Напишите госномер мусоровоза без пробелов тире и других лишних "
         "символов. Пример: Е777КХ124",
@@ -307,6 +639,7 @@ async def process_photo(message: types.Message, state: FSMContext):
 
 @dp.message_handler(state=DriverReport.waiting_for_gos_number,
                     regexp=gos_number_re)
+@traced_step('gos_number')
 async def get_gos_number(message: types.Message, state: FSMContext):
     await state.update_data(gos_number=message.text.upper())
 
@@ -318,13 +651,24 @@ async def get_gos_number(message: types.Message, state: FSMContext):
         f"Причина: {user_data['reason']}\n"
         f"Госномер: {user_data.get('gos_number')}"
     )
-    await message.answer_photo(photo=user_data['photo'],
-                               caption=confirmation_text,
-                               reply_markup=get_confirmation_keyboard())
+    photos = user_data['photos']
+    if len(photos) == 1:
+        await message.answer_photo(photo=photos[0],
+                                   caption=confirmation_text,
+                                   reply_markup=get_confirmation_keyboard())
+    else:
+        # К альбому нельзя прикрепить кнопки, поэтому они идут отдельно
+        media = types.MediaGroup()
+        for photo in photos:
+            media.attach_photo(photo)
+        await message.answer_media_group(media)
+        await message.answer(confirmation_text,
+                             reply_markup=get_confirmation_keyboard())
     await DriverReport.confirmation.set()
 
 
 @dp.message_handler(state=DriverReport.waiting_for_gos_number)
+@traced_step('gos_number_retry')
 async def check_get_gos_number(message: types.Message):
     """Отрабатывает если госномер не соответствует паттерну"""
     await message.answer(
@@ -335,6 +679,7 @@ async def check_get_gos_number(message: types.Message):
 
 @dp.callback_query_handler(lambda callback: callback.data == "confirm",
                            state=DriverReport.confirmation)
+@traced_step('confirm')
 async def confirm_data(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.answer("Информация принята. Спасибо!")
     user_data = await state.get_data()
@@ -357,5 +702,30 @@ async def random_text_message_answer(message: types.Message) -> None:
     await message.reply(text=text, reply_markup=get_main_menu())
 
 
+async def on_startup(dispatcher: Dispatcher):
+    """Прогревает бота и запускает фоновые задачи.
+
+    Прием обновлений начинается только после завершения on_startup.
+    """
+    await warm_up(dispatcher.bot)
+    asyncio.create_task(pending_reports_loop(dispatcher.bot,
+                                             PENDING_RETRY_INTERVAL))
+    asyncio.create_task(stats_persist_loop(REPORT_STATS, database_path,
+                                           STATS_PERSIST_INTERVAL))
+    asyncio.create_task(maintenance_loop(database_path, ARCHIVE_FOLDER,
+                                         REPORTS_RETENTION_DAYS,
+                                         MAINTENANCE_INTERVAL))
+    asyncio.create_task(digest_loop(dispatcher.bot, database_path,
+                                    DIGEST_INTERVAL, DIGEST_RATE, TIMEDELTA))
+    asyncio.create_task(spans_flush_loop(TRACES_FLUSH_INTERVAL))
+
+
+async def on_shutdown(dispatcher: Dispatcher):
+    """Записывает накопленные интервалы трассировки перед остановкой."""
+    flush_spans()
+
+
 if __name__ == '__main__':
-    executor.start_polling(dp, skip_updates=True)
+    executor.start_polling(dp, skip_updates=True, on_startup=on_startup,
+                           on_shutdown=on_shutdown)
+
@@ -0,0 +1,62 @@
+"""Промежуточные обработчики (middleware) бота."""
+import asyncio
+import logging
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from update_journal import JournalWriter
+
+logger = logging.getLogger(__name__)
+
+
+class AlbumMiddleware(BaseMiddleware):
+    """
+    Собирает сообщения одного альбома (media group) в одно.
+
+    Telegram присылает каждое фото альбома отдельным сообщением. Первое
+    сообщение альбома ждет latency секунд, пока придут остальные, и
+    передает обработчику их все в аргументе album. Для остальных
+    сообщений альбома обработчик не вызывается.
+
+    Args:
+        latency (float): Сколько ждать остальные сообщения альбома, секунд.
+    """
+
+    def __init__(self, latency: float = 0.6):
+        self.latency = latency
+        self.albums: dict[str, list[types.Message]] = {}
+        super().__init__()
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        if not message.media_group_id:
+            return
+        album = self.albums.get(message.media_group_id)
+        if album is not None:
+            album.append(message)
+            raise CancelHandler()
+
+        self.albums[message.media_group_id] = [message]
+        await asyncio.sleep(self.latency)
+        album = self.albums.pop(message.media_group_id)
+        data['album'] = sorted(album, key=lambda item: item.message_id)
+
+
+class JournalMiddleware(BaseMiddleware):
+    """
+    Записывает каждое входящее обновление в журнал для воспроизведения.
+
+    Args:
+        writer (JournalWriter): Журнал обновлений.
+    """
+
+    def __init__(self, writer: JournalWriter):
+        self.writer = writer
+        super().__init__()
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        try:
+            self.writer.write(update.to_python())
+        except Exception as e:
+            logger.error("Ошибка при записи обновления в журнал: %s", e)
@@ -0,0 +1,284 @@
+"""
+Версионные миграции схемы базы данных.
+
+Примененные миграции записываются в таблицу schema_version. Каждая миграция
+выполняется в отдельной транзакции вместе с записью о ней, поэтому при
+ошибке база остается в состоянии предыдущей версии.
+
+Первая миграция повторяет прежнюю схему из init_db с IF NOT EXISTS, так
+что существующие базы принимают ее без изменений.
+
+После миграций база один раз переводится в режим auto_vacuum=INCREMENTAL,
+который нужен обслуживанию базы (storage_maintenance.py). Для этого
+выполняется полный VACUUM, поэтому он делается здесь, до начала приема
+обновлений, а не в фоновом обслуживании.
+
+Применение и оценка времени на копии базы:
+    python migrations.py database/users.db
+    python migrations.py database/users.db --dry-run
+"""
+import argparse
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать освобождения базы другим соединением, секунд
+BUSY_TIMEOUT = 30
+
+MIGRATIONS = [
+    (1, 'Базовая схема', [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            full_name TEXT,
+            phone_number TEXT,
+            username TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS admins (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS driver_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp INTEGER,
+            full_name TEXT,
+            phone_number TEXT,
+            username TEXT,
+            user_id INTEGER,
+            zone TEXT,
+            latitude REAL,
+            longitude REAL,
+            reason TEXT,
+            gos_number TEXT,
+            photo_name TEXT,
+            full_address TEXT,
+            city TEXT,
+            county TEXT,
+            district TEXT,
+            suburb TEXT,
+            street TEXT,
+            house_number TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS ban_list (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS zones (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            active INTEGER NOT NULL DEFAULT 1
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS reasons (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            active INTEGER NOT NULL DEFAULT 1
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+        ''',
+        "INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)",
+        '''
+        CREATE TABLE IF NOT EXISTS pending_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            report_id INTEGER,
+            created_at TEXT,
+            photo TEXT,
+            missing TEXT
+        )
+        ''',
+    ]),
+    (2, 'Индексы admins.user_id и ban_list.user_id', [
+        "CREATE INDEX IF NOT EXISTS idx_admins_user_id ON admins (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_ban_list_user_id ON ban_list (user_id)",
+    ]),
+    # Индексы большой таблицы заявок создаются отдельными миграциями,
+    # чтобы каждая блокировала запись в базу как можно меньше
+    (3, 'Индекс driver_reports.timestamp', [
+        "CREATE INDEX IF NOT EXISTS idx_driver_reports_timestamp "
+        "ON driver_reports (timestamp)",
+    ]),
+    (4, 'Индекс driver_reports.user_id', [
+        "CREATE INDEX IF NOT EXISTS idx_driver_reports_user_id "
+        "ON driver_reports (user_id)",
+    ]),
+    (5, 'Снимки счетчиков статистики', [
+        '''
+        CREATE TABLE IF NOT EXISTS stats_snapshot (
+            day TEXT PRIMARY KEY,
+            data TEXT
+        )
+        ''',
+    ]),
+    (6, 'Границы техзон', [
+        "ALTER TABLE zones ADD COLUMN min_lat REAL",
+        "ALTER TABLE zones ADD COLUMN min_lon REAL",
+        "ALTER TABLE zones ADD COLUMN max_lat REAL",
+        "ALTER TABLE zones ADD COLUMN max_lon REAL",
+    ]),
+    (7, 'Сводки заявок кураторам техзон', [
+        "ALTER TABLE driver_reports ADD COLUMN photo_ids TEXT",
+        # Прежние заявки связываются с техзонами в link_reports_to_zones,
+        # когда справочник техзон уже заполнен
+        "ALTER TABLE driver_reports ADD COLUMN zone_id INTEGER",
+        "CREATE INDEX IF NOT EXISTS idx_driver_reports_zone_id "
+        "ON driver_reports (zone_id)",
+        '''
+        CREATE TABLE IF NOT EXISTS supervisors (
+            user_id INTEGER NOT NULL,
+            zone_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, zone_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS digest_watermark (
+            user_id INTEGER PRIMARY KEY,
+            report_id INTEGER NOT NULL
+        )
+        ''',
+    ]),
+]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Возвращает номер последней примененной миграции."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at INTEGER,
+            duration REAL
+        )
+    ''')
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def apply_migrations(db_path: str
+                     ) -> tuple[list[tuple[int, str, float]], float | None]:
+    """
+    Применяет к базе миграции, которых в ней еще нет.
+
+    Returns:
+        tuple[list[tuple[int, str, float]], float | None]: Версия, описание
+        и длительность каждой примененной миграции в секундах и
+        длительность перевода базы в режим auto_vacuum=INCREMENTAL (None,
+        если база уже в нем).
+    """
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT,
+                           isolation_level=None)
+    applied = []
+    try:
+        current = get_schema_version(conn)
+        for version, description, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            start = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for statement in statements:
+                    conn.execute(statement)
+                duration = time.perf_counter() - start
+                conn.execute(
+                    "INSERT INTO schema_version (version, description, "
+                    "applied_at, duration) VALUES (?, ?, ?, ?)",
+                    (version, description, int(time.time()), duration))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            logger.info("Применена миграция %s: %s (%.2f с)", version,
+                        description, duration)
+            applied.append((version, description, duration))
+        vacuum_duration = enable_incremental_vacuum(conn)
+    finally:
+        conn.close()
+    return applied, vacuum_duration
+
+
+def enable_incremental_vacuum(conn: sqlite3.Connection) -> float | None:
+    """
+    Переводит базу в режим auto_vacuum=INCREMENTAL, если она еще не в нем.
+
+    Returns:
+        float | None: Длительность VACUUM в секундах или None, если база
+        уже в этом режиме.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return None
+    start = time.perf_counter()
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    duration = time.perf_counter() - start
+    logger.info("База переведена в режим auto_vacuum=INCREMENTAL (%.2f с)",
+                duration)
+    return duration
+
+
+def dry_run(db_path: str
+            ) -> tuple[list[tuple[int, str, float]], float | None]:
+    """
+    Применяет миграции к копии базы и возвращает их длительность, как
+    apply_migrations.
+
+    Рабочая база не изменяется. Копия делается через backup API, поэтому
+    ее можно снимать с базы, с которой работает бот.
+    """
+    folder = tempfile.mkdtemp()
+    copy_path = os.path.join(folder, os.path.basename(db_path))
+    try:
+        source = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+        target = sqlite3.connect(copy_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        return apply_migrations(copy_path)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Миграции базы данных')
+    parser.add_argument('db_path')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='оценить время миграций на копии базы')
+    args = parser.parse_args()
+
+    results, vacuum_duration = (dry_run(args.db_path) if args.dry_run
+                                else apply_migrations(args.db_path))
+    if not results:
+        print('Новых миграций нет')
+    for version, description, duration in results:
+        print(f"{version:>4}  {duration:8.2f} с  {description}")
+    if vacuum_duration is not None:
+        print(f"Перевод в режим auto_vacuum=INCREMENTAL: "
+              f"{vacuum_duration:.2f} с")
+    if args.dry_run and (results or vacuum_duration is not None):
+        total = sum(result[2] for result in results) + (vacuum_duration or 0)
+        print(f"Всего: {total:.2f} с")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,6 @@ class UserData(TypedDict):
     latitude: float
     longitude: float
     reason: str
-    photo: str
+    photos: list[str]
     gos_number: str
-    ya_disk_file_name: str
\ No newline at end of file
+    trace_id: str
\ No newline at end of file
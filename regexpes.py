@@ -1,2 +1,7 @@
+import re
+
 phone_number_re = r'^(8|\+7)[\- ]?\(?\d{3}\)?[\- ]?\d{3}[\- ]?\d{2}[\- ]?\d{2}$'
-gos_number_re = r'^[АВЕКМНОРСТУХ]\d{3}(?<!000)[АВЕКМНОРСТУХ]{2}\d{2,3}$'
\ No newline at end of file
+gos_number_re = r'^[АВЕКМНОРСТУХ]\d{3}(?<!000)[АВЕКМНОРСТУХ]{2}\d{2,3}$'
+# Координаты текстом: "56.0153, 92.8932" или "56,0153 92,8932"
+coordinates_re = re.compile(
+    r'^\s*(-?\d{1,2}[.,]\d+)\s*[,;\s]\s*(-?\d{1,3}[.,]\d+)\s*$')
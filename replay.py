@@ -0,0 +1,266 @@
+"""
+Воспроизведение журнала обновлений (см. update_journal.py).
+
+Обновления из журнала передаются в dp бота с исходными паузами между ними,
+ускоренными в speed раз (при speed 0 без пауз). Telegram, Яндекс Диск,
+сервис адресов и таблица Google заменяются заглушками с задержкой
+latency секунд, поэтому время обработки зависит только от кода бота.
+По окончании печатается время обработки обновлений по их видам.
+
+Учетные данные внешних сервисов не нужны: клиенты не создаются, а
+переменные окружения бота подменяются до импорта settings. Заявки и
+трассировки пишутся во временную папку, по умолчанию в копию
+database/users.db, рабочая база не изменяется. Журнал обновлений при
+воспроизведении отключен.
+    python replay.py logs/journal/updates-*.journal --speed 10
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import gspread
+from aiogram import Bot, Dispatcher, types
+from oauth2client.service_account import ServiceAccountCredentials
+
+from database_functions import (is_user_registered, register_user,
+                                load_user_caches)
+from gps_functions import ADDRESS_KEYS
+from update_journal import read_journal
+
+# Токен нужного Bot формата, запросы к Telegram все равно не отправляются
+STUB_TOKEN = '123456:replay'
+SOURCE_DB_PATH = os.path.join('database', 'users.db')
+
+_message_ids = itertools.count(1)
+
+
+async def stub_request(self, method: str, data: dict | None = None,
+                       files=None, **kwargs):
+    """Заглушка Bot.request: отвечает как Telegram, ничего не отправляя."""
+    data = data or {}
+    message = {'message_id': next(_message_ids), 'date': int(time.time()),
+               'chat': {'id': int(data.get('chat_id', 0)),
+                        'type': 'private'}}
+    if method == 'getMe':
+        return {'id': 1, 'is_bot': True, 'first_name': 'replay'}
+    if method == 'getFile':
+        return {'file_id': data.get('file_id'), 'file_unique_id': 'replay',
+                'file_path': 'replay.jpg'}
+    if method == 'sendMediaGroup':
+        return [message]
+    if method.startswith('send') or method.startswith('edit'):
+        return message
+    return True
+
+
+def prepare_environment(db_path: str, folder: str) -> None:
+    """
+    Настраивает окружение бота для воспроизведения до импорта settings.
+
+    Переменные окружения задаются явно, поэтому значения из .env рабочей
+    установки не используются. Клиент таблиц Google не создается.
+    """
+    os.environ['DATABASE_PATH'] = db_path
+    os.environ['TRACES_DB_PATH'] = os.path.join(folder, 'traces.db')
+    os.environ['TELEGRAM_TOKEN'] = STUB_TOKEN
+    os.environ['GSHEETS_KEY'] = ''
+    os.environ['UPDATE_JOURNAL_FOLDER'] = ''
+    os.environ.setdefault('TIMEDELTA', '0')
+    ServiceAccountCredentials.from_json_keyfile_name = classmethod(
+        lambda cls, *args, **kwargs: None)
+    gspread.authorize = lambda credentials: None
+
+
+def copy_database(source_path: str, target_path: str) -> None:
+    """Копирует базу через backup API, если она есть."""
+    if not os.path.exists(source_path):
+        return
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def install_stubs(latency: float) -> None:
+    """Подменяет обращения к внешним сервисам заглушками."""
+    import bots_func
+    from tracing import Span
+
+    async def upload_report_photo(file_id: str, tg_bot: Bot,
+                                  trace_id: str | None = None,
+                                  notify_dev: bool = True) -> str:
+        with Span(trace_id, 'disk_upload'):
+            await asyncio.sleep(latency)
+        return f'replay_{file_id}.jpg'
+
+    async def get_report_address(latitude: float, longitude: float,
+                                 tg_bot: Bot,
+                                 trace_id: str | None = None,
+                                 notify_dev: bool = True) -> dict:
+        with Span(trace_id, 'geocode'):
+            await asyncio.sleep(latency)
+        return dict.fromkeys(ADDRESS_KEYS, 'replay')
+
+    def upload_information_to_gsheets(*args) -> None:
+        time.sleep(latency)
+
+    Bot.request = stub_request
+    bots_func.upload_report_photo = upload_report_photo
+    bots_func.get_report_address = get_report_address
+    bots_func.upload_information_to_gsheets = upload_information_to_gsheets
+
+
+def get_update_kind(update: types.Update) -> str:
+    """Вид обновления для статистики: тип и тип содержимого сообщения."""
+    for kind in ('message', 'edited_message'):
+        message = getattr(update, kind)
+        if message:
+            if message.is_command():
+                return f"{kind}:{message.get_command(pure=True)}"
+            return f"{kind}:{message.content_type}"
+    if update.callback_query:
+        return 'callback_query'
+    return 'other'
+
+
+def register_senders(db_path: str, records: list[tuple[float, dict]]) -> int:
+    """
+    Регистрирует отправителей обновлений, которых нет в базе.
+
+    id в журнале обезличены и не совпадают с id в базе, поэтому без
+    регистрации обновления заявок отклонялись бы как от новых пользователей.
+    """
+    registered = 0
+    for _, data in records:
+        for kind in ('message', 'callback_query'):
+            user_id = data.get(kind, {}).get('from', {}).get('id')
+            if user_id and not is_user_registered(db_path, user_id):
+                register_user(db_path, user_id, 'Водитель', '80000000000',
+                              None)
+                registered += 1
+    return registered
+
+
+def get_chat_id(update: types.Update) -> int | None:
+    """id чата, в котором пришло обновление."""
+    message = update.message or update.edited_message
+    if message:
+        return message.chat.id
+    if update.callback_query:
+        return update.callback_query.from_user.id
+    return None
+
+
+async def replay(dp: Dispatcher, records: list[tuple[float, dict]],
+                 speed: float) -> dict[str, list[float]]:
+    """
+    Передает обновления в dp и замеряет время их обработки.
+
+    Обновления разных чатов обрабатываются параллельно через
+    process_updates, как при polling. Обновления одного чата ждут окончания
+    обработки предыдущего, иначе при ускорении шаги диалога перемешались
+    бы. Исключение - фото одного альбома, они передаются одновременно.
+
+    Returns:
+        dict[str, list[float]]: Длительности обработки по виду обновления.
+    """
+    durations: dict[str, list[float]] = {}
+    # По id чата: альбом последнего обновления, задачи, которых ждет
+    # последнее обновление, и задачи последнего обновления или альбома
+    chains: dict[int | None, tuple[str | None, list, list]] = {}
+
+    async def process(update: types.Update, wait_for: list) -> None:
+        await asyncio.gather(*wait_for, return_exceptions=True)
+        start = time.perf_counter()
+        await dp.process_updates([update])
+        durations.setdefault(get_update_kind(update), []).append(
+            time.perf_counter() - start)
+
+    first_received = records[0][0] if records else 0
+    start = time.monotonic()
+    for received_at, data in records:
+        if speed:
+            delay = (received_at - first_received) / speed - (
+                    time.monotonic() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        update = types.Update(**data)
+        chat_id = get_chat_id(update)
+        message = update.message
+        album = message.media_group_id if message else None
+        group, waited, current = chains.get(chat_id, (None, [], []))
+        if album is None or album != group:
+            waited, current = current, []
+        task = asyncio.create_task(process(update, waited))
+        chains[chat_id] = (album, waited, current + [task])
+    await asyncio.gather(*(task for _, _, current in chains.values()
+                           for task in current))
+    return durations
+
+
+def format_report(durations: dict[str, list[float]]) -> str:
+    """Таблица времени обработки в миллисекундах по видам обновлений."""
+    lines = [f"{'вид':<32}{'шт':>6}{'сред':>9}{'p50':>9}{'p95':>9}"
+             f"{'макс':>9}"]
+    for kind, values in sorted(durations.items()):
+        values = sorted(values)
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        lines.append(f"{kind:<32}{len(values):>6}"
+                     f"{statistics.mean(values) * 1000:>9.1f}"
+                     f"{statistics.median(values) * 1000:>9.1f}"
+                     f"{p95 * 1000:>9.1f}{values[-1] * 1000:>9.1f}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Воспроизведение журнала обновлений')
+    parser.add_argument('journals', nargs='+', help='файлы журнала')
+    parser.add_argument('--speed', type=float, default=1,
+                        help='ускорение, 0 - без пауз между обновлениями')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='задержка заглушек внешних сервисов, секунд')
+    parser.add_argument('--db',
+                        help='база для воспроизведения, по умолчанию '
+                             f'временная копия {SOURCE_DB_PATH}')
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='replay_')
+    try:
+        db_path = args.db or os.path.join(folder, 'users.db')
+        if not args.db:
+            copy_database(SOURCE_DB_PATH, db_path)
+        prepare_environment(db_path, folder)
+        install_stubs(args.latency)
+        # main импортируется после подмены: при импорте он настраивает dp
+        import main as bot_main
+        Bot.set_current(bot_main.bot)
+        Dispatcher.set_current(bot_main.dp)
+
+        records = sorted((record for path in args.journals
+                          for record in read_journal(path)),
+                         key=lambda record: record[0])
+        load_user_caches(db_path)
+        registered = register_senders(db_path, records)
+        print(f"Обновлений: {len(records)}, зарегистрировано водителей: "
+              f"{registered}")
+
+        start = time.perf_counter()
+        durations = asyncio.run(replay(bot_main.dp, records, args.speed))
+        print(f"Воспроизведено за {time.perf_counter() - start:.2f} с")
+        print(format_report(durations))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,9 @@ from oauth2client.service_account import ServiceAccountCredentials
 from dotenv import load_dotenv
 from gspread import authorize
 
+from circuit_breaker import CircuitBreaker
 from database_functions import init_db
+from stats import ReportStats
 
 load_dotenv()
 
@@ -13,7 +15,8 @@ load_dotenv()
 log_folder = 'logs'
 log_file = os.path.join(log_folder, 'bot.log')
 
-database_path = init_db('database', 'users.db')
+database_path = init_db(*os.path.split(
+    os.getenv('DATABASE_PATH', os.path.join('database', 'users.db'))))
 
 API_TOKEN = os.getenv('TELEGRAM_TOKEN')
 
@@ -35,6 +38,58 @@ GPS_API_KEY = os.getenv('GPS_API_KEY')
 DEV_TG_ID = os.getenv('DEV_TG_ID')
 TIMEDELTA = int(os.getenv('TIMEDELTA'))
 
+# Предохранители внешних сервисов
+BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', 0.5))
+BREAKER_RECOVERY_TIMEOUT = int(os.getenv('BREAKER_RECOVERY_TIMEOUT', 60))
+GPS_BREAKER = CircuitBreaker('Geoapify', BREAKER_FAILURE_RATE,
+                             recovery_timeout=BREAKER_RECOVERY_TIMEOUT)
+YANDEX_BREAKER = CircuitBreaker('Яндекс Диск', BREAKER_FAILURE_RATE,
+                                recovery_timeout=BREAKER_RECOVERY_TIMEOUT)
+GOOGLE_BREAKER = CircuitBreaker('Google Sheets', BREAKER_FAILURE_RATE,
+                                recovery_timeout=BREAKER_RECOVERY_TIMEOUT)
+# Оперативная статистика для команд /stats
+REPORT_STATS = ReportStats(TIMEDELTA)
+STATS_PERSIST_INTERVAL = int(os.getenv('STATS_PERSIST_INTERVAL', 300))
+
+# Сколько фото одновременно загружается на Яндекс Диск
+PHOTO_UPLOAD_CONCURRENCY = int(os.getenv('PHOTO_UPLOAD_CONCURRENCY', 3))
+# Максимум фото в одной заявке, как в альбоме Telegram
+MAX_REPORT_PHOTOS = 10
+
+# Сколько ждать обновлений трансляции геопозиции перед приемом точки, секунд
+LIVE_LOCATION_SETTLE = int(os.getenv('LIVE_LOCATION_SETTLE', 10))
+# Границы техзон в GeoJSON, название техзоны в свойстве name
+ZONES_GEOJSON = os.getenv('ZONES_GEOJSON',
+                          os.path.join('database', 'zones.geojson'))
+
+# Журнал входящих обновлений для replay.py, включается заданием папки.
+# Ключ обезличивания id лучше задать постоянным, иначе он меняется при
+# каждом запуске
+UPDATE_JOURNAL_FOLDER = os.getenv('UPDATE_JOURNAL_FOLDER')
+UPDATE_JOURNAL_MAX_BYTES = int(os.getenv('UPDATE_JOURNAL_MAX_BYTES',
+                                         64 * 1024 * 1024))
+UPDATE_JOURNAL_SECRET = (os.getenv('UPDATE_JOURNAL_SECRET', '').encode()
+                         or os.urandom(32))
+
+# Сводки заявок кураторам техзон: интервал в секундах и общий темп
+# отправки сообщений в секунду
+DIGEST_INTERVAL = int(os.getenv('DIGEST_INTERVAL', 60 * 60))
+DIGEST_RATE = float(os.getenv('DIGEST_RATE', 20))
+
+# Как часто интервалы трассировки записываются из буфера в базу, секунд
+TRACES_FLUSH_INTERVAL = int(os.getenv('TRACES_FLUSH_INTERVAL', 60))
+
+# Интервал в секундах между попытками дозагрузить отложенные заявки
+PENDING_RETRY_INTERVAL = int(os.getenv('PENDING_RETRY_INTERVAL', 300))
+
+# Обслуживание базы: заявки старше REPORTS_RETENTION_DAYS переносятся в архив
+REPORTS_RETENTION_DAYS = int(os.getenv('REPORTS_RETENTION_DAYS', 90))
+ARCHIVE_FOLDER = os.path.join('database', 'archive')
+MAINTENANCE_INTERVAL = int(os.getenv('MAINTENANCE_INTERVAL', 24 * 60 * 60))
+
+# Файл, который создается после прогрева, для проверки готовности контейнера
+READY_FILE = os.getenv('READY_FILE')
+
 text_message_answers = [
     'Я могу отвечать только на вопросы выбранные из меню. Воспользуйтесь им пожалуйста.',
     'Я не наделен искусственным интеллектом. Воспользуйтесь меню пожалуйста.',
@@ -42,6 +97,8 @@ text_message_answers = [
     'Я был бы рад поболтать, но могу отвечать только на вопросы из меню. Воспользуйтесь меню пожалуйста.',
 ]
 
+# Начальные значения справочников, дальше они хранятся в базе данных
+# и редактируются администраторами командами бота (см. catalog.py)
 zones = ["Правобережная", "Левобережная", "Норильская", "Железногорская",
          "Зеленогорская", "Минусинская", "Таймырская"]
 
@@ -0,0 +1,146 @@
+"""
+Оперативная статистика для команд /stats.
+
+Счетчики за текущие сутки хранятся в памяти и обновляются по мере
+сохранения заявок и обращений к внешним сервисам, поэтому команды
+администраторов не обращаются к базе данных. При запуске счетчики заявок
+восстанавливаются из driver_reports, счетчики ошибок - из последнего
+снимка, который периодически сохраняется в stats_snapshot.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from database_functions import (get_reports_since, count_pending_reports,
+                                save_stats_snapshot, get_stats_snapshot)
+
+logger = logging.getLogger(__name__)
+
+OK = 'ok'
+ERROR = 'error'
+REJECTED = 'rejected'
+
+
+class ReportStats:
+    """
+    Счетчики заявок и обращений к внешним сервисам за текущие сутки.
+
+    Args:
+        hours_offset (int): Сдвиг часового пояса, как TIMEDELTA в settings.
+    """
+
+    def __init__(self, hours_offset: int = 0):
+        self.hours_offset = hours_offset
+        self.day = self.today()
+        self.zones = Counter()
+        self.reasons = Counter()
+        self.calls = {}
+        self.in_progress = 0
+        self.pending = 0
+
+    def today(self) -> str:
+        """Текущая дата с учетом сдвига часового пояса."""
+        return (datetime.now() + timedelta(hours=self.hours_offset)).strftime(
+            '%Y-%m-%d')
+
+    def day_start_timestamp(self) -> int:
+        """UNIX-время начала текущих суток с учетом сдвига."""
+        now = datetime.now() + timedelta(hours=self.hours_offset)
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        return int(time.time() - (now - midnight).total_seconds())
+
+    def _check_day(self) -> None:
+        """Обнуляет дневные счетчики после полуночи."""
+        today = self.today()
+        if today != self.day:
+            self.day = today
+            self.zones.clear()
+            self.reasons.clear()
+            self.calls = {}
+
+    def report_saved(self, zone: str, reason: str) -> None:
+        """Учитывает сохраненную заявку."""
+        self._check_day()
+        self.zones[zone] += 1
+        self.reasons[reason] += 1
+
+    def call_finished(self, service: str, outcome: str) -> None:
+        """Учитывает обращение к внешнему сервису: OK, ERROR или REJECTED."""
+        self._check_day()
+        self.calls.setdefault(service, Counter())[outcome] += 1
+
+    def rebuild(self, db_path: str) -> None:
+        """Восстанавливает счетчики из базы данных при запуске."""
+        self.day = self.today()
+        rows = get_reports_since(db_path, self.day_start_timestamp())
+        self.zones = Counter(zone for zone, _ in rows)
+        self.reasons = Counter(reason for _, reason in rows)
+        self.pending = count_pending_reports(db_path)
+        snapshot = get_stats_snapshot(db_path, self.day)
+        self.calls = ({service: Counter(counts) for service, counts in
+                       json.loads(snapshot).get('calls', {}).items()}
+                      if snapshot else {})
+
+    def persist(self, db_path: str) -> None:
+        """Сохраняет снимок счетчиков за текущие сутки."""
+        data = {
+            'zones': self.zones,
+            'reasons': self.reasons,
+            'calls': self.calls,
+        }
+        save_stats_snapshot(db_path, self.day,
+                            json.dumps(data, ensure_ascii=False))
+
+    def summary(self) -> str:
+        """Текст для команды /stats."""
+        self._check_day()
+        lines = [f"Статистика за {self.day}",
+                 f"Заявок: {sum(self.zones.values())}",
+                 f"Сохраняются сейчас: {self.in_progress}",
+                 f"Ожидают дозагрузки: {self.pending}"]
+        lines.append(self.errors_text())
+        return "\n".join(lines)
+
+    def zones_text(self) -> str:
+        """Текст для команды /stats_zones."""
+        self._check_day()
+        if not self.zones:
+            return "Сегодня заявок нет"
+        return "\n".join(f"{zone}: {count}"
+                         for zone, count in self.zones.most_common())
+
+    def reasons_text(self, limit: int = 10) -> str:
+        """Текст для команды /stats_reasons."""
+        self._check_day()
+        if not self.reasons:
+            return "Сегодня заявок нет"
+        return "\n".join(f"{count} - {reason}"
+                         for reason, count in self.reasons.most_common(limit))
+
+    def errors_text(self) -> str:
+        """Доля ошибок обращений к внешним сервисам."""
+        self._check_day()
+        if not self.calls:
+            return "Обращений к внешним сервисам сегодня не было"
+        lines = []
+        for service, counts in self.calls.items():
+            total = sum(counts.values())
+            failed = counts[ERROR] + counts[REJECTED]
+            lines.append(f"{service}: ошибок {failed} из {total} "
+                         f"({failed / total:.0%}), без вызова "
+                         f"{counts[REJECTED]}")
+        return "\n".join(lines)
+
+
+async def stats_persist_loop(stats: ReportStats, db_path: str,
+                             interval: int) -> None:
+    """Периодически сохраняет снимок счетчиков."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            stats.persist(db_path)
+        except Exception as e:
+            logger.error("Ошибка при сохранении статистики: %s", e)
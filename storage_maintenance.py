@@ -0,0 +1,277 @@
+"""
+Обслуживание базы данных заявок.
+
+Заявки старше заданного срока переносятся из driver_reports в помесячные
+архивные базы database/archive/reports_ГГГГ_ММ.db. В архиве повторяющиеся
+значения (техзона, причина, город, район, улица) хранятся один раз в
+таблице dictionary, а данные водителя - в таблице people; заявка хранит
+только их id. Представление driver_reports в архиве возвращает заявки в
+том же виде, что и рабочая база, поэтому запросы к ней не меняются.
+
+После переноса рабочая база сжимается (incremental vacuum) и для нее
+обновляется статистика планировщика запросов (ANALYZE). Режим
+auto_vacuum=INCREMENTAL включается при миграциях базы.
+
+Запуск вручную:
+    python storage_maintenance.py database/users.db --days 90
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Столбцы, значения которых кодируются через словарь
+DICTIONARY_COLUMNS = ['zone', 'reason', 'city', 'county', 'district',
+                      'suburb', 'street']
+REPORT_COLUMNS = ['id', 'timestamp', 'full_name', 'phone_number', 'username',
+                  'user_id', 'zone', 'latitude', 'longitude', 'reason',
+                  'gos_number', 'photo_name', 'full_address', 'city',
+                  'county', 'district', 'suburb', 'street', 'house_number',
+                  'photo_ids', 'zone_id']
+# Столбцы, добавленные в архив после его первой версии. zone_id рабочей
+# базы хранится в архиве как catalog_zone_id: zone_id в архиве - id
+# названия техзоны в словаре
+ARCHIVE_ADDED_COLUMNS = {'photo_ids': 'TEXT', 'catalog_zone_id': 'INTEGER'}
+# Сколько заявок переносится за одну транзакцию
+ARCHIVE_BATCH_SIZE = 500
+
+
+def open_archive(archive_path: str) -> sqlite3.Connection:
+    """Открывает архивную базу, создавая ее схему при необходимости."""
+    conn = sqlite3.connect(archive_path)
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS dictionary (
+            id INTEGER PRIMARY KEY,
+            value TEXT UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS people (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            full_name TEXT,
+            phone_number TEXT,
+            username TEXT,
+            UNIQUE (user_id, full_name, phone_number, username)
+        );
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY,
+            timestamp INTEGER,
+            person_id INTEGER REFERENCES people (id),
+            zone_id INTEGER REFERENCES dictionary (id),
+            latitude REAL,
+            longitude REAL,
+            reason_id INTEGER REFERENCES dictionary (id),
+            gos_number TEXT,
+            photo_name TEXT,
+            full_address TEXT,
+            city_id INTEGER REFERENCES dictionary (id),
+            county_id INTEGER REFERENCES dictionary (id),
+            district_id INTEGER REFERENCES dictionary (id),
+            suburb_id INTEGER REFERENCES dictionary (id),
+            street_id INTEGER REFERENCES dictionary (id),
+            house_number TEXT,
+            photo_ids TEXT,
+            catalog_zone_id INTEGER
+        );
+    ''')
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(reports)")}
+    for column, column_type in ARCHIVE_ADDED_COLUMNS.items():
+        if column not in columns:
+            conn.execute(f"ALTER TABLE reports ADD COLUMN {column} "
+                         f"{column_type}")
+    # Представление пересоздается, чтобы в нем были новые столбцы
+    conn.executescript('''
+        DROP VIEW IF EXISTS driver_reports;
+        CREATE VIEW driver_reports AS
+            SELECT r.id, r.timestamp, p.full_name, p.phone_number,
+                p.username, p.user_id, zone.value AS zone, r.latitude,
+                r.longitude, reason.value AS reason, r.gos_number,
+                r.photo_name, r.full_address, city.value AS city,
+                county.value AS county, district.value AS district,
+                suburb.value AS suburb, street.value AS street,
+                r.house_number, r.photo_ids, r.catalog_zone_id AS zone_id
+            FROM reports r
+            LEFT JOIN people p ON p.id = r.person_id
+            LEFT JOIN dictionary zone ON zone.id = r.zone_id
+            LEFT JOIN dictionary reason ON reason.id = r.reason_id
+            LEFT JOIN dictionary city ON city.id = r.city_id
+            LEFT JOIN dictionary county ON county.id = r.county_id
+            LEFT JOIN dictionary district ON district.id = r.district_id
+            LEFT JOIN dictionary suburb ON suburb.id = r.suburb_id
+            LEFT JOIN dictionary street ON street.id = r.street_id;
+    ''')
+    return conn
+
+
+def get_dictionary_id(conn: sqlite3.Connection, cache: dict,
+                      value: str | None) -> int | None:
+    """Возвращает id значения в словаре архива, добавляя его при отсутствии."""
+    if value is None:
+        return None
+    if value not in cache:
+        conn.execute("INSERT OR IGNORE INTO dictionary (value) VALUES (?)",
+                     (value,))
+        cache[value] = conn.execute(
+            "SELECT id FROM dictionary WHERE value = ?", (value,)).fetchone()[0]
+    return cache[value]
+
+
+def get_person_id(conn: sqlite3.Connection, cache: dict,
+                  person: tuple) -> int:
+    """Возвращает id данных водителя в архиве, добавляя их при отсутствии."""
+    if person not in cache:
+        conn.execute(
+            "INSERT OR IGNORE INTO people (user_id, full_name, phone_number, "
+            "username) VALUES (?, ?, ?, ?)", person)
+        cache[person] = conn.execute(
+            "SELECT id FROM people WHERE user_id IS ? AND full_name IS ? "
+            "AND phone_number IS ? AND username IS ?", person).fetchone()[0]
+    return cache[person]
+
+
+def write_to_archive(archive_path: str, rows: list[dict]) -> None:
+    """
+    Записывает заявки в архивную базу одной транзакцией.
+
+    Заявки сохраняют свой id, поэтому повторный перенос той же заявки
+    (если процесс прервался до удаления из рабочей базы) ничего не дублирует.
+    """
+    conn = open_archive(archive_path)
+    dictionary, people = {}, {}
+    try:
+        with conn:
+            for row in rows:
+                person = (row['user_id'], row['full_name'],
+                          row['phone_number'], row['username'])
+                ids = {column: get_dictionary_id(conn, dictionary, row[column])
+                       for column in DICTIONARY_COLUMNS}
+                conn.execute('''
+                    INSERT OR IGNORE INTO reports (
+                        id, timestamp, person_id, zone_id, latitude,
+                        longitude, reason_id, gos_number, photo_name,
+                        full_address, city_id, county_id, district_id,
+                        suburb_id, street_id, house_number, photo_ids,
+                        catalog_zone_id
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+                        ?, ?)
+                ''', (row['id'], row['timestamp'],
+                      get_person_id(conn, people, person), ids['zone'],
+                      row['latitude'], row['longitude'], ids['reason'],
+                      row['gos_number'], row['photo_name'],
+                      row['full_address'], ids['city'], ids['county'],
+                      ids['district'], ids['suburb'], ids['street'],
+                      row['house_number'], row['photo_ids'],
+                      row['zone_id']))
+    finally:
+        conn.close()
+
+
+def archive_old_reports(db_path: str, archive_folder: str,
+                        max_age_days: int) -> int:
+    """
+    Переносит заявки старше max_age_days в помесячные архивные базы.
+
+    Заявки, ожидающие дозагрузки данных (pending_reports), не переносятся.
+
+    Returns:
+        int: Количество перенесенных заявок.
+    """
+    os.makedirs(archive_folder, exist_ok=True)
+    cutoff = int(time.time()) - max_age_days * 24 * 60 * 60
+    moved = 0
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        while True:
+            rows = conn.execute(f'''
+                SELECT {', '.join(REPORT_COLUMNS)} FROM driver_reports
+                WHERE timestamp < ?
+                    AND id NOT IN (SELECT report_id FROM pending_reports)
+                ORDER BY id LIMIT ?
+            ''', (cutoff, ARCHIVE_BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+
+            months = {}
+            for row in rows:
+                month = datetime.fromtimestamp(row['timestamp']).strftime(
+                    '%Y_%m')
+                months.setdefault(month, []).append(dict(row))
+            for month, month_rows in months.items():
+                write_to_archive(
+                    os.path.join(archive_folder, f'reports_{month}.db'),
+                    month_rows)
+
+            # Удаляем из рабочей базы только после записи в архив
+            with conn:
+                conn.executemany("DELETE FROM driver_reports WHERE id = ?",
+                                 [(row['id'],) for row in rows])
+            moved += len(rows)
+    finally:
+        conn.close()
+    return moved
+
+
+def compact_database(db_path: str) -> None:
+    """
+    Освобождает место после удаления заявок и обновляет статистику.
+
+    Место освобождается только в режиме auto_vacuum=INCREMENTAL, в который
+    база переводится при миграциях (migrations.py). Полный VACUUM здесь не
+    выполняется: он блокирует базу, пока бот принимает заявки.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            conn.execute("PRAGMA incremental_vacuum")
+        else:
+            logger.warning("База %s не в режиме auto_vacuum=INCREMENTAL, "
+                           "место не освобождается", db_path)
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+
+
+def run_maintenance(db_path: str, archive_folder: str,
+                    max_age_days: int) -> str:
+    """Переносит старые заявки в архив и сжимает рабочую базу."""
+    start = time.perf_counter()
+    size_before = os.path.getsize(db_path)
+    moved = archive_old_reports(db_path, archive_folder, max_age_days)
+    compact_database(db_path)
+    size_after = os.path.getsize(db_path)
+    return (f"Обслуживание базы: перенесено в архив {moved} заявок, "
+            f"размер {size_before // 1024} -> {size_after // 1024} КБ "
+            f"за {time.perf_counter() - start:.1f} с")
+
+
+async def maintenance_loop(db_path: str, archive_folder: str,
+                           max_age_days: int, interval: int) -> None:
+    """Периодически выполняет обслуживание базы в отдельном потоке."""
+    while True:
+        try:
+            report = await asyncio.to_thread(run_maintenance, db_path,
+                                             archive_folder, max_age_days)
+            logger.info(report)
+        except Exception as e:
+            logger.error("Ошибка при обслуживании базы: %s", e)
+        await asyncio.sleep(interval)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Обслуживание базы заявок')
+    parser.add_argument('db_path')
+    parser.add_argument('--archive-folder',
+                        default=os.path.join('database', 'archive'))
+    parser.add_argument('--days', type=int, default=90,
+                        help='возраст заявок для переноса в архив, дней')
+    args = parser.parse_args()
+    print(run_maintenance(args.db_path, args.archive_folder, args.days))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""
+Трассировка заявок водителей.
+
+Каждая заявка получает trace_id при нажатии кнопки подачи заявки. Для
+каждого шага машины состояний и каждого обращения к внешним сервисам
+записывается интервал (span) с длительностью и результатом. Интервалы
+хранятся в отдельной базе SQLite.
+
+Просмотр самых медленных заявок:
+    python tracing.py slowest -n 10
+    python tracing.py show <trace_id>
+"""
+import argparse
+import asyncio
+import functools
+import logging
+import os
+import sqlite3
+import time
+import uuid
+
+from aiogram import Dispatcher
+
+logger = logging.getLogger(__name__)
+
+TRACES_DB_PATH = os.getenv('TRACES_DB_PATH',
+                           os.path.join('database', 'traces.db'))
+# Количество интервалов, после которого буфер записывается в базу
+FLUSH_SIZE = 200
+
+STEP = 'step'
+CALL = 'call'
+
+_buffer: list[tuple] = []
+
+
+def init_traces_db(db_path: str = TRACES_DB_PATH) -> None:
+    """Создает таблицу интервалов, если ее нет."""
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS spans (
+                trace_id TEXT,
+                name TEXT,
+                kind TEXT,
+                started_at REAL,
+                duration REAL,
+                outcome TEXT
+            )
+        ''')
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_spans_trace ON spans (trace_id)")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def new_trace_id() -> str:
+    """Возвращает новый идентификатор трассы."""
+    return uuid.uuid4().hex[:16]
+
+
+def record_span(trace_id: str | None, name: str, kind: str,
+                started_at: float, duration: float, outcome: str) -> None:
+    """Добавляет интервал в буфер. Без trace_id ничего не делает."""
+    if trace_id is None:
+        return
+    _buffer.append((trace_id, name, kind, started_at, duration, outcome))
+    if len(_buffer) >= FLUSH_SIZE:
+        flush_spans()
+
+
+def flush_spans(db_path: str = TRACES_DB_PATH) -> None:
+    """Записывает накопленные интервалы в базу."""
+    if not _buffer:
+        return
+    spans = _buffer[:]
+    _buffer.clear()
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executemany("INSERT INTO spans VALUES (?, ?, ?, ?, ?, ?)", spans)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+async def spans_flush_loop(interval: int) -> None:
+    """
+    Периодически записывает накопленные интервалы в базу.
+
+    Без этого интервалы брошенных на полпути заявок оставались бы в буфере,
+    пока он не заполнится.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            flush_spans()
+        except Exception as e:
+            logger.error("Ошибка при записи трассировки: %s", e)
+
+
+class Span:
+    """
+    Контекстный менеджер, записывающий интервал вызова внешнего сервиса.
+
+    Пример:
+        with Span(trace_id, 'geocode'):
+            get_address_from_coordinates(...)
+    """
+
+    def __init__(self, trace_id: str | None, name: str, kind: str = CALL):
+        self.trace_id = trace_id
+        self.name = name
+        self.kind = kind
+
+    def __enter__(self):
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        outcome = 'ok' if exc_type is None else exc_type.__name__
+        record_span(self.trace_id, self.name, self.kind, self.started_at,
+                    time.perf_counter() - self._start, outcome)
+        return False
+
+
+def traced_step(name: str):
+    """
+    Декоратор обработчика, записывающий шаг машины состояний.
+
+    trace_id берется из данных состояния до выполнения обработчика, а если
+    его там нет (начало заявки), то после. Когда заявка завершена или
+    отменена, интервалы записываются в базу, остальные - spans_flush_loop.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            state = Dispatcher.get_current().current_state()
+            trace_id = (await state.get_data()).get('trace_id')
+            with Span(trace_id, name, STEP) as step:
+                result = await handler(*args, **kwargs)
+                if step.trace_id is None:
+                    step.trace_id = (await state.get_data()).get('trace_id')
+            if await state.get_state() is None:
+                flush_spans()
+            return result
+        return wrapper
+    return decorator
+
+
+def get_union_length(intervals: list[tuple[float, float]]) -> float:
+    """Длина объединения интервалов (начало, конец)."""
+    total = 0.0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+def get_slowest_traces(db_path: str, limit: int) -> list[dict]:
+    """
+    Возвращает самые долгие трассы и этап, занявший больше всего времени.
+
+    Время шага считается без вложенных в него вызовов внешних сервисов,
+    чтобы этапом-лидером оказался сам медленный вызов, а не шаг вокруг него.
+    Вызовы выполняются параллельно (загрузка фото, поиск адреса), поэтому
+    время этапа и вложенных вызовов - длина объединения их интервалов, а
+    не сумма длительностей.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute('''
+            SELECT trace_id, name, kind, started_at, duration, outcome
+            FROM spans WHERE trace_id IN (
+                SELECT trace_id FROM spans WHERE kind = ?
+                GROUP BY trace_id ORDER BY SUM(duration) DESC LIMIT ?
+            ) ORDER BY started_at
+        ''', (STEP, limit)).fetchall()
+    finally:
+        conn.close()
+
+    traces = {}
+    for trace_id, name, kind, started_at, duration, outcome in rows:
+        traces.setdefault(trace_id, []).append(
+            (name, kind, started_at, duration, outcome))
+
+    result = []
+    for trace_id, spans in traces.items():
+        steps = [s for s in spans if s[1] == STEP]
+        calls = [s for s in spans if s[1] == CALL]
+        stages = {}
+        for name, _, started_at, duration, _ in steps:
+            finished_at = started_at + duration
+            nested = get_union_length([
+                (c[2], min(c[2] + c[3], finished_at)) for c in calls
+                if started_at <= c[2] <= finished_at])
+            stages[name] = stages.get(name, 0) + max(duration - nested, 0)
+        intervals = {}
+        for name, _, started_at, duration, _ in calls:
+            intervals.setdefault(name, []).append(
+                (started_at, started_at + duration))
+        for name, call_intervals in intervals.items():
+            stages[name] = stages.get(name, 0) + get_union_length(
+                call_intervals)
+        dominant = max(stages, key=stages.get)
+        result.append({
+            'trace_id': trace_id,
+            'started_at': spans[0][2],
+            'total': sum(s[3] for s in steps),
+            'dominant': dominant,
+            'dominant_duration': stages[dominant],
+            'errors': [s[0] for s in spans if s[4] != 'ok'],
+        })
+    result.sort(key=lambda trace: trace['total'], reverse=True)
+    return result
+
+
+def get_trace(db_path: str, trace_id: str) -> list[tuple]:
+    """Возвращает интервалы трассы в порядке начала."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT name, kind, started_at, duration, outcome FROM spans "
+            "WHERE trace_id = ? ORDER BY started_at", (trace_id,)).fetchall()
+    finally:
+        conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Трассы заявок водителей')
+    parser.add_argument('--db', default=TRACES_DB_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    slowest = commands.add_parser('slowest', help='самые долгие заявки')
+    slowest.add_argument('-n', type=int, default=10)
+    show = commands.add_parser('show', help='интервалы одной заявки')
+    show.add_argument('trace_id')
+    args = parser.parse_args()
+
+    if args.command == 'slowest':
+        for trace in get_slowest_traces(args.db, args.n):
+            started = time.strftime('%Y-%m-%d %H:%M:%S',
+                                    time.localtime(trace['started_at']))
+            errors = ', '.join(trace['errors']) or '-'
+            print(f"{trace['trace_id']}  {started}  "
+                  f"{trace['total']:8.2f} с  "
+                  f"{trace['dominant']} {trace['dominant_duration']:.2f} с  "
+                  f"ошибки: {errors}")
+    else:
+        spans = get_trace(args.db, args.trace_id)
+        if not spans:
+            print('Трасса не найдена')
+            return
+        start = spans[0][2]
+        for name, kind, started_at, duration, outcome in spans:
+            indent = '  ' if kind == CALL else ''
+            print(f"+{started_at - start:8.2f} с  {indent}{name:<20} "
+                  f"{duration:8.3f} с  {outcome}")
+
+
+if __name__ == '__main__':
+    main()
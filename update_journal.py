@@ -0,0 +1,158 @@
+"""
+Журнал входящих обновлений Telegram.
+
+Каждое обновление обезличивается и дописывается в конец файла журнала
+записью вида: заголовок HEADER (длина данных, время получения, CRC32) и
+JSON обновления, сжатый zlib. Когда файл превышает max_bytes, начинается
+новый. Журнал читается read_journal и воспроизводится replay.py.
+
+Обезличивание:
+    - id пользователей и чатов заменяются HMAC от секрета, одинаковые id
+      дают одинаковые замены, поэтому диалоги сохраняются;
+    - имена и username удаляются, номера телефонов заменяются PHONE_STUB;
+    - госномера, координаты, команды и данные кнопок сохраняются как есть,
+      остальной текст заменяется буквами 'х' той же длины.
+"""
+import hashlib
+import hmac
+import json
+import os
+import re
+import struct
+import time
+import zlib
+from datetime import datetime
+from typing import Iterator
+
+from regexpes import gos_number_re, phone_number_re, coordinates_re
+
+# Длина сжатых данных, время получения, CRC32 сжатых данных
+HEADER = struct.Struct('<IdI')
+
+PHONE_STUB = '+70000000000'
+NAME_STUB = 'Пользователь'
+# Объекты, поле id которых является id пользователя или чата
+ID_OWNERS = {'from', 'chat', 'user', 'forward_from', 'forward_from_chat',
+             'sender_chat', 'via_bot'}
+NAME_KEYS = {'last_name', 'username', 'title', 'bio', 'address'}
+TEXT_KEYS = {'text', 'caption'}
+
+
+def mask_text(text: str) -> str:
+    """Заменяет текст буквами 'х' той же длины, сохраняя пробелы."""
+    return re.sub(r'\S', 'х', text)
+
+
+def anonymize_text(text: str) -> str:
+    """Оставляет текст, от которого зависит выбор обработчика, остальное скрывает."""
+    stripped = text.strip()
+    if stripped.startswith('/') or coordinates_re.match(stripped) or \
+            re.match(gos_number_re, stripped, re.IGNORECASE):
+        return text
+    if re.match(phone_number_re, stripped):
+        return PHONE_STUB
+    return mask_text(text)
+
+
+class Anonymizer:
+    """
+    Обезличивает обновления Telegram.
+
+    Args:
+        secret (bytes): Ключ HMAC для замены id. Чтобы замены совпадали
+            между перезапусками бота, ключ нужно задать постоянным.
+    """
+
+    def __init__(self, secret: bytes):
+        self.secret = secret
+
+    def map_id(self, value: int) -> int:
+        """Заменяет id пользователя или чата, сохраняя знак."""
+        digest = hmac.new(self.secret, str(abs(value)).encode(),
+                          hashlib.sha256).digest()
+        mapped = int.from_bytes(digest[:6], 'big') or 1
+        return -mapped if value < 0 else mapped
+
+    def anonymize(self, data, owner: str | None = None):
+        """Возвращает обезличенную копию словаря обновления."""
+        if isinstance(data, list):
+            return [self.anonymize(item, owner) for item in data]
+        if not isinstance(data, dict):
+            return data
+        result = {}
+        for key, value in data.items():
+            if key in NAME_KEYS:
+                continue
+            if key == 'first_name':
+                result[key] = NAME_STUB
+            elif key == 'phone_number':
+                result[key] = PHONE_STUB
+            elif key == 'user_id' or (key == 'id' and owner in ID_OWNERS):
+                result[key] = self.map_id(value)
+            elif key in TEXT_KEYS and isinstance(value, str):
+                result[key] = anonymize_text(value)
+            else:
+                result[key] = self.anonymize(value, key)
+        return result
+
+
+class JournalWriter:
+    """
+    Дописывает обновления в файлы журнала в папке folder.
+
+    Args:
+        folder (str): Папка файлов журнала.
+        max_bytes (int): Размер файла, после которого начинается новый.
+        secret (bytes): Ключ обезличивания, см. Anonymizer.
+    """
+
+    def __init__(self, folder: str, max_bytes: int, secret: bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.anonymizer = Anonymizer(secret)
+        self._file = None
+        os.makedirs(folder, exist_ok=True)
+
+    def _open(self) -> None:
+        name = datetime.now().strftime('updates-%Y%m%d-%H%M%S-%f.journal')
+        self._file = open(os.path.join(self.folder, name), 'ab')
+
+    def write(self, update: dict, received_at: float | None = None) -> None:
+        """Обезличивает обновление и дописывает его в журнал."""
+        if self._file is None or self._file.tell() >= self.max_bytes:
+            self.close()
+            self._open()
+        payload = zlib.compress(json.dumps(
+            self.anonymizer.anonymize(update), ensure_ascii=False,
+            separators=(',', ':')).encode('utf-8'))
+        self._file.write(HEADER.pack(len(payload), received_at or time.time(),
+                                     zlib.crc32(payload)))
+        self._file.write(payload)
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_journal(path: str) -> Iterator[tuple[float, dict]]:
+    """
+    Читает записи файла журнала.
+
+    Недописанная или поврежденная запись в конце файла (бот остановлен во
+    время записи) пропускается вместе со всем, что после нее.
+
+    Yields:
+        tuple[float, dict]: Время получения и обновление.
+    """
+    with open(path, 'rb') as file:
+        while True:
+            header = file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            length, received_at, crc = HEADER.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                return
+            yield received_at, json.loads(zlib.decompress(payload))
@@ -0,0 +1,96 @@
+"""
+Прогрев бота при запуске.
+
+До начала приема обновлений открывает таблицу Google, проверяет папку
+на Яндекс Диске, устанавливает соединения с внешними сервисами и загружает
+кэши из базы данных, чтобы первая заявка после перезапуска обрабатывалась
+так же быстро, как последующие.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from aiogram import Bot
+
+from api_functions import check_disk_folder, get_worksheet
+from catalog import reload_catalog
+from database_functions import load_user_caches
+from gps_functions import warm_up_geocoder
+from settings import (DEV_TG_ID, YANDEX_CLIENT, YA_DISK_FOLDER,
+                      GOOGLE_CLIENT, GOOGLE_SHEET_NAME, database_path,
+                      READY_FILE, REPORT_STATS)
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длительность одного шага прогрева, секунд
+STEP_TIMEOUT = 30
+
+_ready = asyncio.Event()
+
+
+def is_ready() -> bool:
+    """Показывает, завершен ли прогрев."""
+    return _ready.is_set()
+
+
+async def run_step(name: str, func, *args) -> tuple[str, float, str]:
+    """
+    Выполняет шаг прогрева и замеряет его длительность.
+
+    Returns:
+        tuple[str, float, str]: Название шага, длительность в секундах и
+        результат.
+    """
+    start = time.perf_counter()
+    try:
+        if asyncio.iscoroutinefunction(func):
+            await asyncio.wait_for(func(*args), STEP_TIMEOUT)
+        else:
+            await asyncio.wait_for(asyncio.to_thread(func, *args),
+                                   STEP_TIMEOUT)
+        status = 'ok'
+    except asyncio.TimeoutError:
+        status = f'не завершен за {STEP_TIMEOUT} с'
+    except Exception as e:
+        status = f'ошибка: {e}'
+    return name, time.perf_counter() - start, status
+
+
+async def warm_up(tg_bot: Bot) -> list[tuple[str, float, str]]:
+    """
+    Выполняет все шаги прогрева параллельно и сообщает результат.
+
+    Ошибка отдельного шага не останавливает запуск: сервис будет
+    подключен при первом обращении, как без прогрева.
+    """
+    if READY_FILE and os.path.exists(READY_FILE):
+        os.remove(READY_FILE)
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        run_step('Кэш пользователей', load_user_caches, database_path),
+        run_step('Справочники', reload_catalog, database_path),
+        run_step('Статистика', REPORT_STATS.rebuild, database_path),
+        run_step('Таблица Google', get_worksheet, GOOGLE_CLIENT,
+                 GOOGLE_SHEET_NAME),
+        run_step('Яндекс Диск', check_disk_folder, YANDEX_CLIENT,
+                 YA_DISK_FOLDER),
+        run_step('Сервис адресов', warm_up_geocoder),
+        run_step('Telegram', tg_bot.get_me),
+    )
+    total = time.perf_counter() - start
+
+    lines = [f"{name}: {duration:.2f} с, {status}"
+             for name, duration, status in results]
+    report = f"Прогрев завершен за {total:.2f} с\n" + "\n".join(lines)
+    logger.info(report)
+    try:
+        await tg_bot.send_message(DEV_TG_ID, report)
+    except Exception as e:
+        logger.warning("Не удалось отправить отчет о прогреве: %s", e)
+
+    _ready.set()
+    if READY_FILE:
+        with open(READY_FILE, 'w', encoding='utf-8') as file:
+            file.write(report)
+    return results